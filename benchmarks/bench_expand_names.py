@@ -0,0 +1,63 @@
+"""
+Compares the row-wise etl.expand_name_fn against the vectorized etl.expand_names
+
+usage: python benchmarks/bench_expand_names.py [num_rows ...]
+"""
+import sys
+import timeit
+import pandas as pd
+import msc_takehome.etl as etl
+
+
+# one name per style that expand_name_fn handles
+SAMPLE_NAMES = [
+    "pepe lepew",
+    "daffy sheldon duck",
+    "bender",
+    "simpson, lisa",
+    "burns, charles montgomery",
+    "skinner, w. seymour",
+    "simpson, homer j."
+]
+
+
+def make_names_df(num_rows):
+
+    names = (SAMPLE_NAMES * (num_rows // len(SAMPLE_NAMES) + 1))[:num_rows]
+    return pd.DataFrame({"Name": names})
+
+
+def row_wise(df):
+
+    df = df.copy()
+    df["first_name"], df["middle_name"], df["last_name"] = [None, None, None]
+    return df.apply(etl.expand_name_fn, axis=1, name_col="Name")
+
+
+def vectorized(df):
+
+    return df.join(etl.expand_names(df["Name"]))
+
+
+def main(sizes):
+
+    print("{:>10} {:>12} {:>12} {:>8}".format("rows", "row-wise s", "vectorized s", "speedup"))
+
+    for num_rows in sizes:
+
+        df = make_names_df(num_rows)
+
+        # sanity check that both approaches agree before timing them
+        cols = ["first_name", "middle_name", "last_name"]
+        assert row_wise(df)[cols].equals(vectorized(df)[cols])
+
+        repeat = 3
+        row_wise_s = min(timeit.repeat(lambda: row_wise(df), number=1, repeat=repeat))
+        vectorized_s = min(timeit.repeat(lambda: vectorized(df), number=1, repeat=repeat))
+
+        print("{:>10} {:>12.4f} {:>12.4f} {:>7.1f}x".format(num_rows, row_wise_s, vectorized_s, row_wise_s / vectorized_s))
+
+
+if __name__ == '__main__':
+
+    main([int(x) for x in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,260 @@
+"""
+Load tests the web app: serves it locally (in its own process, so that the load generator doesn't compete with it for
+the GIL) against a synthetic roster, drives / and each /report/<view_name> with concurrent clients, and reports the
+throughput and p50/p95/p99 latency of each, as json that can be compared between commits
+
+cold and warm latency are measured separately. a cold request is the first request for a path on a freshly started
+server, with the report cache empty and no pooled connections open yet, so there's only one of them per path per server:
+the cold latency of each path is taken over --cold-starts servers. the warm runs then send --requests requests for each
+path at each concurrency level, to a fresh server that has already served every path once
+
+usage:
+    python benchmarks/load_test.py --size 100000 --concurrency 1 8 32 --requests 200 --out load_results.json
+    python benchmarks/load_test.py --db orchestra.db --concurrency 16 --rate 50 --no-cache
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+import multiprocessing
+import http.client
+import logging
+import argparse
+import platform
+import tempfile
+import sqlite3
+import json
+import time
+import os
+import msc_takehome.etl as etl
+from msc_takehome.reports import REPORT_VIEWS
+from msc_takehome.synthetic import write_roster
+from run_benchmarks import git_commit
+
+
+def serve(db_file, config, ports):
+
+    # runs in its own process: serves the app on a free local port, and sends back which port that is
+    from werkzeug.serving import make_server
+    from msc_takehome.routes import app, report_cache
+
+    app.config.update(DB_FILE=db_file, **config)
+    report_cache.max_size = app.config.get("REPORT_CACHE_SIZE")
+
+    # a log line per request would slow the server down (and bury the results)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def start_server(db_file, config):
+
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(db_file, config, ports), daemon=True)
+    process.start()
+
+    return process, ports.get(timeout=60)
+
+
+def get(port, path):
+
+    # one request over a fresh connection (the dev server closes connections after each response anyway)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values, p):
+
+    # nearest-rank percentile
+    if not sorted_values:
+        return None
+
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))]
+
+
+def drive(port, path, num_requests, concurrency, rate=None):
+
+    # sends num_requests requests for path from `concurrency` clients at once. with a rate (requests per second), request
+    # i is due at i / rate seconds in, and its latency is measured from when it was due rather than from when it was
+    # sent, so that requests held up behind slow ones still count the time they spent waiting
+    latencies = []
+    errors = []
+    lock = Lock()
+    start = time.perf_counter()
+
+    def client(i):
+
+        due = start + i / rate if rate else time.perf_counter()
+        delay = due - time.perf_counter()
+
+        if delay > 0:
+            time.sleep(delay)
+
+        sent = due if rate else time.perf_counter()
+
+        try:
+            status = get(port, path)
+        except (OSError, http.client.HTTPException) as e:
+            status = repr(e)
+
+        latency = time.perf_counter() - sent
+
+        with lock:
+            latencies.append(latency)
+
+            if status != 200:
+                errors.append(status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(num_requests)))
+
+    seconds = time.perf_counter() - start
+    latencies.sort()
+
+    return {
+        "requests": num_requests,
+        "errors": len(errors),
+        "seconds": seconds,
+        "requests_per_second": num_requests / seconds,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else None
+    }
+
+
+def cold_requests(db_file, config, paths, starts):
+
+    # the latency of the first request for each path, on each of `starts` freshly started servers
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+
+    for _ in range(starts):
+
+        process, port = start_server(db_file, config)
+
+        try:
+            for path in paths:
+
+                start = time.perf_counter()
+
+                try:
+                    status = get(port, path)
+                except (OSError, http.client.HTTPException):
+                    status = None
+
+                latencies[path].append(time.perf_counter() - start)
+                errors[path] += status != 200
+        finally:
+            process.terminate()
+            process.join()
+
+    results = []
+
+    for path in paths:
+        samples = sorted(latencies[path])
+        results.append({"path": path, "requests": starts, "errors": errors[path], "p50": percentile(samples, 50),
+                         "max": samples[-1]})
+
+    return results
+
+
+def build_db(args, tmp_dir):
+
+    if args.db:
+        return args.db
+
+    start = time.perf_counter()
+    write_roster(tmp_dir, args.size, seed=args.seed)
+    db_file = os.path.join(tmp_dir, "orchestra.db")
+    etl.db_setup(db_file, data_dir=tmp_dir, bulk=True)
+    print("built a db of {} names in {:.1f}s".format(args.size, time.perf_counter() - start))
+
+    return db_file
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000, help="number of names to generate")
+    parser.add_argument("--db", help="an existing db to serve, instead of generating one")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="requests per path, per warm run")
+    parser.add_argument("--cold-starts", type=int, default=5, help="servers to start to measure cold requests on")
+    parser.add_argument("--rate", type=float, help="requests per second to send (default: as fast as the clients can)")
+    parser.add_argument("--paths", nargs="+", help="paths to request (default: / and every report)")
+    parser.add_argument("--no-cache", action="store_true", help="serve with the report cache disabled")
+    parser.add_argument("--stream", action="store_true", help="serve reports streamed")
+    parser.add_argument("--out", default="load_results.json", help="file to write the results to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = args.paths or ["/"] + ["/report/{}".format(view_name) for view_name in REPORT_VIEWS]
+    config = {"STREAM_REPORTS": args.stream}
+
+    if args.no_cache:
+        config["REPORT_CACHE_SIZE"] = 0
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "config": config,
+        "rate": args.rate,
+        "cold": [],
+        "warm": []
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        db_file = build_db(args, tmp_dir)
+
+        print("cold: first request per path, over {} fresh servers".format(args.cold_starts))
+        print("{:<45} {:>7} {:>9} {:>9}".format("path", "errors", "p50 ms", "max ms"))
+
+        results["cold"] = cold_requests(db_file, config, paths, args.cold_starts)
+
+        for r in results["cold"]:
+            print("{:<45} {:>7} {:>9.2f} {:>9.2f}".format(r["path"], r["errors"], r["p50"] * 1000, r["max"] * 1000))
+
+        print("\nwarm: {} requests per path".format(args.requests))
+        print("{:>6} {:<45} {:>9} {:>7} {:>9} {:>9} {:>9}".format("conc", "path", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms"))
+
+        for concurrency in args.concurrency:
+
+            process, port = start_server(db_file, config)
+
+            try:
+                # every path is served once before it's measured, so that none of the measured requests are cold
+                for path in paths:
+                    get(port, path)
+
+                for path in paths:
+
+                    r = drive(port, path, args.requests, concurrency, args.rate)
+                    r.update(concurrency=concurrency, path=path)
+                    results["warm"].append(r)
+
+                    print("{:>6} {:<45} {:>9.1f} {:>7} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                        concurrency, path, r["requests_per_second"], r["errors"],
+                        r["p50"] * 1000, r["p95"] * 1000, r["p99"] * 1000))
+            finally:
+                process.terminate()
+                process.join()
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,290 @@
+"""
+Times each stage of etl.db_setup, and each of the report views, against synthetic rosters of increasing size, measures
+their peak memory (python allocations via tracemalloc, and peak RSS in a process of their own), and writes
+the results out as json so that they can be compared between commits
+
+usage:
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000 --out results.json
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000 --out new.json --compare results.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, contextmanager
+from datetime import datetime
+from functools import partial
+from importlib import resources
+import multiprocessing
+import subprocess
+import tracemalloc
+import resource
+import argparse
+import platform
+import tempfile
+import sqlite3
+import json
+import time
+import sys
+import os
+import msc_takehome.etl as etl
+from msc_takehome.reports import REPORT_VIEWS, report_query
+from msc_takehome.render import render_table
+from msc_takehome.synthetic import write_roster
+
+
+def measure(fn, memory=True):
+
+    # runs fn, returning its result, how long it took, and (with memory=True) the peak python-level memory it allocated.
+    # tracemalloc slows things down considerably, so memory is measured in a separate run from the timing
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+
+    peak_bytes = None
+
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result, seconds, peak_bytes
+
+
+def max_rss_bytes():
+
+    # the process's peak resident set size so far, which linux reports in kB and macOS in bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+LOAD_SQL = {
+    "instruments": "INSERT INTO instruments(instrument, section) VALUES (?, ?)",
+    "names": "INSERT INTO names(first_name, middle_name, last_name) VALUES (?, ?, ?)",
+    "assignments_by_name": "INSERT INTO assignments_by_name(instrument, first_name, middle_name, last_name) VALUES (?, ?, ?, ?)"
+}
+
+
+def fresh_db(db_file):
+
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    conn = sqlite3.connect(db_file)
+    conn.executescript(resources.read_text("msc_takehome.sql", "create_schema_sqlite.sql"))
+    conn.executescript(resources.read_text("msc_takehome.sql", "create_indexes_sqlite.sql"))
+    return conn
+
+
+# each stage sets up what it needs, then yields the function that runs it, along with a function that counts the rows
+# in its result. stages only depend on the input files in data_dir (and, for the reports, the db that the db_setup
+# stage built), so any one of them can be run on its own in a fresh process, to measure its peak RSS
+
+@contextmanager
+def parse_stage(data_dir, db_file, table):
+
+    yield lambda: list(etl.read_input(data_dir, table)), lambda result: sum(len(df) for df in result)
+
+
+@contextmanager
+def load_stage(data_dir, db_file, table):
+
+    frames = list(etl.read_input(data_dir, table))
+
+    # each load is measured against an empty table, so the load (and its memory run) start from the same place
+    with closing(fresh_db(db_file)) as conn:
+
+        def load():
+            conn.execute("DELETE FROM {}".format(table))
+            for df in frames:
+                etl.load_df(conn, conn.cursor(), df, LOAD_SQL[table])
+
+        yield load, lambda _: conn.execute("SELECT count(*) FROM {}".format(table)).fetchone()[0]
+
+
+@contextmanager
+def link_stage(data_dir, db_file):
+
+    with closing(fresh_db(db_file)) as conn:
+
+        for table, sql in LOAD_SQL.items():
+            for df in etl.read_input(data_dir, table):
+                etl.load_df(conn, conn.cursor(), df, sql)
+
+        def link():
+            conn.execute("DELETE FROM name_keys")
+            conn.execute("DELETE FROM assignments")
+            etl.link_assignments(conn.cursor())
+            conn.commit()
+
+        yield link, lambda _: conn.execute("SELECT count(*) FROM assignments").fetchone()[0]
+
+
+@contextmanager
+def db_setup_stage(data_dir, db_file):
+
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    yield lambda: etl.db_setup(db_file, data_dir=data_dir), None
+
+
+@contextmanager
+def query_stage(data_dir, db_file, view_name):
+
+    with closing(sqlite3.connect(db_file)) as conn:
+        yield lambda: conn.execute(report_query(view_name)).fetchall(), len
+
+
+@contextmanager
+def render_stage(data_dir, db_file, view_name):
+
+    with closing(sqlite3.connect(db_file)) as conn:
+        yield lambda: render_table(conn.execute(report_query(view_name))), \
+            lambda _: len(conn.execute(report_query(view_name)).fetchall())
+
+
+def etl_stages():
+
+    # the same stages that db_setup runs, one at a time, followed by db_setup as a whole
+    stages = {}
+
+    for table in etl.INPUTS:
+        stages["parse_{}".format(table)] = partial(parse_stage, table=table)
+
+    for table in LOAD_SQL:
+        stages["load_{}".format(table)] = partial(load_stage, table=table)
+
+    stages["link_assignments"] = link_stage
+    stages["db_setup"] = db_setup_stage
+
+    return stages
+
+
+def report_stages():
+
+    stages = {}
+
+    for view_name in REPORT_VIEWS:
+        stages["query_{}".format(view_name)] = partial(query_stage, view_name=view_name)
+        stages["render_{}".format(view_name)] = partial(render_stage, view_name=view_name)
+
+    return stages
+
+
+def stage_rss(stage, data_dir, db_file):
+
+    # runs in a fresh process, so that the peak RSS is the stage's own, on top of what the interpreter, the imports, and
+    # the stage's setup already took (the baseline)
+    stages = {**etl_stages(), **report_stages()}
+
+    with stages[stage](data_dir, db_file) as (fn, _):
+        base_rss_bytes = max_rss_bytes()
+        fn()
+
+        return {"base_rss_bytes": base_rss_bytes, "peak_rss_bytes": max_rss_bytes()}
+
+
+def run_stages(stages, data_dir, db_file, memory, rss_db_file):
+
+    # times each stage in this process, and with memory=True, measures its peak RSS in a process of its own, against
+    # rss_db_file
+    results = []
+
+    for stage, setup in stages.items():
+
+        with setup(data_dir, db_file) as (fn, rows):
+            result, seconds, peak_bytes = measure(fn, memory)
+            r = {"stage": stage, "seconds": seconds, "peak_bytes": peak_bytes, "rows": rows(result) if rows else None,
+                 "base_rss_bytes": None, "peak_rss_bytes": None}
+
+        # a process's peak RSS starts out at least as high as that of the process it was started from, so the RSS runs
+        # are forked from the (small) forkserver process, rather than from this one, which grows as it goes
+        if memory:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("forkserver")) as executor:
+                r.update(executor.submit(stage_rss, stage, data_dir, rss_db_file).result())
+
+        results.append(r)
+
+    return results
+
+
+def bench_etl_stages(data_dir, db_file, memory):
+
+    # the etl stages write their own db, so their RSS runs get a scratch db, rather than the one the reports are run on
+    return run_stages(etl_stages(), data_dir, db_file, memory, os.path.join(data_dir, "rss.db"))
+
+
+def bench_reports(db_file, memory):
+
+    return run_stages(report_stages(), os.path.dirname(db_file), db_file, memory, db_file)
+
+
+def git_commit():
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+
+    # prints how long each stage took relative to the baseline run, for the sizes/stages that both runs have
+    baseline_seconds = {(r["size"], r["stage"]): r["seconds"] for r in baseline["results"]}
+
+    print("{:>10} {:<40} {:>10} {:>10} {:>8}".format("size", "stage", "base s", "new s", "ratio"))
+
+    for r in results["results"]:
+
+        key = (r["size"], r["stage"])
+
+        if key in baseline_seconds:
+            print("{:>10} {:<40} {:>10.4f} {:>10.4f} {:>7.2f}x".format(
+                r["size"], r["stage"], baseline_seconds[key], r["seconds"], r["seconds"] / baseline_seconds[key]))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of names to generate")
+    parser.add_argument("--out", default="bench_results.json", help="file to write the results to")
+    parser.add_argument("--compare", help="a previous results file to compare against")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) peak memory and peak RSS measurements")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": []
+    }
+
+    for size in args.sizes:
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+
+            start = time.perf_counter()
+            write_roster(tmp_dir, size, seed=args.seed)
+            print("generated {} names in {:.1f}s".format(size, time.perf_counter() - start))
+
+            db_file = os.path.join(tmp_dir, "orchestra.db")
+
+            for r in bench_etl_stages(tmp_dir, db_file, not args.no_memory) + bench_reports(db_file, not args.no_memory):
+                r["size"] = size
+                results["results"].append(r)
+                print("{:>10} {:<40} {:>10.4f}s {:>14} bytes {:>14} bytes rss".format(
+                    size, r["stage"], r["seconds"], r["peak_bytes"] or "-", r["peak_rss_bytes"] or "-"))
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+
+    main()
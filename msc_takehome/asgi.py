@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags, quote_etag
+from msc_takehome.routes import app as flask_app, get_report_name, report_source, cached_report, report_latency
+from flask import render_template
+import asyncio
+import time
+
+
+# an async alternative to serving the flask app: an asgi app for the index and the full report pages, for running under
+# an asgi server with a handful of workers (e.g. `uvicorn msc_takehome.asgi:app --workers 4`). queries and rendering run
+# on a bounded thread pool, so a worker's event loop never blocks on sqlite, and identical requests that arrive while a
+# report is being rendered wait for that render rather than starting their own
+
+
+class SingleFlight(object):
+    """
+    Runs blocking calls on a thread pool, sharing the result of a call with every caller that asks for the same key
+    while that call is still running
+    """
+
+    def __init__(self, executor):
+
+        self.executor = executor
+        self.calls = {}
+        # callers that got the result of a call made for someone else
+        self.shared = 0
+
+
+    async def do(self, key, fn, *args):
+
+        future = self.calls.get(key)
+
+        if future is None:
+
+            future = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+            self.calls[key] = future
+
+            def forget(done):
+                if self.calls.get(key) is done:
+                    del self.calls[key]
+
+            future.add_done_callback(forget)
+
+        else:
+            self.shared += 1
+
+        # a caller that goes away (e.g. a client disconnecting) shouldn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+
+executor = ThreadPoolExecutor(max_workers=flask_app.config.get("ASGI_THREADS"), thread_name_prefix="report")
+single_flight = SingleFlight(executor)
+
+
+def load_index():
+
+    # the templates build links with url_for, so they're rendered in a (synthetic) request context for the page
+    with flask_app.test_request_context("/"):
+        return None, render_template("index.html", reports=flask_app.config.get("REPORTS"))
+
+
+def load_report(view_name):
+
+    # the report's etag and page, the same as the flask app's /report/<view_name> serves them
+    with flask_app.test_request_context("/report/{}".format(view_name)):
+
+        version, render = report_source(view_name)
+
+        if version is None:
+            return None, render()
+
+        return "{}-{}".format(version, view_name), cached_report(view_name, version, render)
+
+
+async def send_response(send, status, body=b"", etag=None, head=False):
+
+    # a HEAD request gets the same headers as a GET (including the length of the body it would have got), without the body
+    headers = [(b"content-type", b"text/html; charset=utf-8"), (b"content-length", str(len(body)).encode())]
+
+    if etag is not None:
+        headers.append((b"etag", quote_etag(etag).encode()))
+
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+async def send_error(send, e, head=False):
+
+    # the routes abort with an http error when they can't serve a request (e.g. a 503 when no db connection is free),
+    # which gets the same status and error page that the flask app would send for it
+    await send_response(send, e.code, e.get_body().encode(), head=head)
+
+
+async def lifespan(receive, send):
+
+    while True:
+
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def reject_websocket(receive, send):
+
+    # there are no websocket routes, so the handshake is turned down (which the server answers with a 403)
+    message = await receive()
+
+    if message["type"] == "websocket.connect":
+        await send({"type": "websocket.close"})
+
+
+async def app(scope, receive, send):
+
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "websocket":
+        return await reject_websocket(receive, send)
+
+    if scope["type"] != "http":
+        raise ValueError("unsupported asgi scope type: {}".format(scope["type"]))
+
+    path = scope["path"]
+    head = scope["method"] == "HEAD"
+
+    if scope["method"] not in ("GET", "HEAD"):
+        return await send_response(send, 405)
+
+    if path == "/":
+
+        try:
+            _, content = await single_flight.do("/", load_index)
+        except HTTPException as e:
+            return await send_error(send, e, head)
+
+        return await send_response(send, 200, content.encode(), head=head)
+
+    view_name = path[len("/report/"):] if path.startswith("/report/") else None
+
+    if view_name is None or get_report_name(view_name) is None:
+        return await send_response(send, 404)
+
+    start = time.perf_counter()
+
+    try:
+        etag, content = await single_flight.do(view_name, load_report, view_name)
+    except HTTPException as e:
+        return await send_error(send, e, head)
+
+    headers = dict(scope["headers"])
+
+    if etag is not None and parse_etags(headers.get(b"if-none-match", b"").decode("latin-1")).contains(etag):
+        await send_response(send, 304, etag=etag)
+    else:
+        await send_response(send, 200, content.encode(), etag=etag, head=head)
+
+    report_latency.observe(time.perf_counter() - start, view=view_name, phase="total")
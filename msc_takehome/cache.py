@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class ReportCache(object):
+    """
+    A thread-safe, size-limited cache of rendered reports, which evicts the least recently used entry once full. entries
+    are expected to be keyed on the db version as well as the report, so that an etl run implicitly invalidates them
+    """
+
+    def __init__(self, max_size):
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+
+    def __len__(self):
+
+        return len(self._entries)
+
+
+    def get(self, key):
+
+        with self._lock:
+
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+
+    def put(self, key, value):
+
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
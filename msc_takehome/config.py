@@ -1,6 +1,52 @@
 class Config(object):
 
     DB_FILE = "orchestra.db"
+    # page cache size (in KiB) and memory-mapped I/O size (in bytes) for each of the web tier's pooled, read-only connections
+    DB_CACHE_SIZE_KB = 65536
+    DB_MMAP_SIZE = 268435456
+    # max number of connections each db file's pool keeps open, and how long (in seconds) a request waits for one to be
+    # returned once they're all in use, before it's turned away with a 503
+    DB_POOL_SIZE = 16
+    DB_POOL_TIMEOUT = 30
+    # number of rows to parse and load at a time during the etl; None loads each input file in one go
+    ETL_CHUNK_SIZE = None
+    # directory to read names.txt, instruments.csv, and name_instrument.csv from; None uses the files bundled in msc_takehome/data
+    ETL_DATA_DIR = None
+    # apply only the changes between the input files and an existing db, instead of rebuilding it from scratch
+    ETL_INCREMENTAL = False
+    # load everything in one transaction with relaxed durability, building indexes after the data is in
+    ETL_BULK_LOAD = False
+    # number of processes to parse the input files with; None parses them serially, in the same process as the db writer
+    ETL_WORKERS = None
+    # don't run the etl at startup if the db was already built from the same input files and schema
+    ETL_SKIP_UNCHANGED = True
+    # number of backups of previous dbs to keep when the etl rebuilds the db
+    DB_BACKUPS = 3
+    # snapshot each report view into a table at the end of the etl, and serve reports from those tables
+    MATERIALIZE_REPORTS = False
+    # build full reports from an in-memory copy of the roster, reloaded whenever the db version changes, instead of the views
+    ROSTER_INDEX = False
+    # max number of rendered report pages to keep in memory; 0 disables caching
+    REPORT_CACHE_SIZE = 32
+    # stream report pages out as their rows are read, rather than rendering them in full first (overridden by ?stream=0/1)
+    STREAM_REPORTS = False
+    # upper limit on the ?page_size of a paginated report
+    REPORT_MAX_PAGE_SIZE = 1000
+    # upper limit on the ?page_size of a search
+    SEARCH_MAX_PAGE_SIZE = 100
+    # log report queries that take at least this many seconds, along with their query plan; None disables the log
+    SLOW_QUERY_SECONDS = None
+    # number of rows to read off the cursor at a time when exporting a report, and how hard to gzip the export
+    EXPORT_BATCH_SIZE = 1000
+    EXPORT_GZIP_LEVEL = 6
+    # max number of threads each worker of the asgi app (msc_takehome.asgi) runs report queries on
+    ASGI_THREADS = 8
+    # one db (shard) per ensemble, each loaded from its own input files, eg {"symphony": {"db_file": ..., "data_dir": ...}}.
+    # when set, DB_FILE / ETL_DATA_DIR are ignored, and reports, exports, and metrics are merged from every ensemble's shard.
+    # reports can't be paged or streamed, and /search isn't available (each shard ranks its matches on its own)
+    ENSEMBLES = {}
+    # max number of shards to read from at once when merging a report
+    SHARD_THREADS = 8
     REPORTS = [
         {
             "view": "all_musicians",
@@ -1,24 +1,184 @@
 import sqlite3
-from contextlib import closing
+from contextlib import closing, nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from importlib import resources
 from pathlib import Path
 from datetime import datetime
+from collections import Counter, deque
+from msc_takehome.metrics import StageTimer
+from msc_takehome.reports import refresh_report_tables, report_tables_match, set_db_version
+from msc_takehome.search import SEARCHES, rebuild_search_index, update_search_index
 import pandas as pd
+import numpy as np
+import itertools
+import hashlib
+import logging
+import json
+import time
+import io
 import re
 import os
 
 
+logger = logging.getLogger(__name__)
+
+# the time spent, and rows processed, in each stage of the current (or most recent) etl run in this process
+stage_timer = StageTimer()
+
+
+# all of the name styles handled by `expand_name_fn`, combined into a single anchored pattern so that the whole column can
+# be classified and split in one pass. group names are prefixed by the style they belong to, since python's `re` doesn't
+# allow a group name to be reused across alternatives
+NAME_PATTERN = re.compile(
+    r"^(?:"
+    r"(?P<fl_first>\w+) (?P<fl_last>\w+)"  # first last
+    r"|(?P<fml_first>\w+) (?P<fml_middle>[\w.]+) (?P<fml_last>\w+)"  # first middle last
+    r"|(?P<f_first>\w+)"  # first
+    r"|(?P<lf_last>\w+), (?P<lf_first>[\w.]+)"  # last, first
+    r"|(?P<lfm_last>\w+), (?P<lfm_first>[\w.]+) (?P<lfm_middle>[\w.]+)"  # last, first middle
+    r")$"
+)
+
+
 def create_db_file(db_file):
 
-    db_file_path = Path(db_file)
+    # the db is built in a temporary file next to it, and only swapped in once it's complete. anything left over from a
+    # build that didn't finish is thrown away first
+    build_file = "{}.tmp".format(db_file)
+
+    for path in [build_file, build_file + "-journal", build_file + "-wal", build_file + "-shm"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+    Path(build_file).touch()
+
+    return build_file
+
+
+def rotate_backups(db_file, backups):
+
+    # keeps only the most recent `backups` backups of the db. backup file names sort by the time they were taken
+    for backup_file in sorted(Path(db_file).parent.glob("{}.*.bak".format(Path(db_file).name)))[:-backups or None]:
+        backup_file.unlink()
+
+
+def swap_db_file(build_file, db_file, backups=3):
+
+    # backs up the current db, and then copies the newly built one over it, both with sqlite's online backup api, so that
+    # a consistent copy is taken even while the web tier is reading from it. the current db file is written to in place
+    # rather than replaced: renaming a new file over a db that readers have open can corrupt it, since both files would
+    # share the same -wal and -shm files. readers see the new db from their next transaction on
+    if not os.path.exists(db_file):
+        os.replace(build_file, db_file)
+        return
+
+    with closing(sqlite3.connect(db_file)) as conn:
+
+        if backups:
+            backup_file = "{}.{}.bak".format(db_file, datetime.now().strftime("%Y%m%d%H%M%S%f"))
+
+            with closing(sqlite3.connect(backup_file)) as backup:
+                conn.backup(backup)
+
+        with closing(sqlite3.connect(build_file)) as build:
+            build.backup(conn)
+
+        # fold the copy back out of the write-ahead log and into the db file
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    rotate_backups(db_file, backups)
+    os.remove(build_file)
+
+
+SCHEMA_FILES = ["create_schema_sqlite.sql", "create_indexes_sqlite.sql"]
+
+
+def file_digest(f):
+
+    digest = hashlib.sha256()
+
+    for block in iter(lambda: f.read(1 << 20), b""):
+        digest.update(block)
+
+    return digest.digest()
+
+
+def combine_digests(digests):
+
+    # hashes each file's name along with the hash of its contents, so that the boundaries between files are part of the
+    # fingerprint: moving bytes from the end of one file to the start of the next changes it
+    fingerprint = hashlib.sha256()
+
+    for file_name, digest in digests:
+        fingerprint.update(file_name.encode() + b"\0" + digest)
+
+    return fingerprint
+
+
+def schema_fingerprint():
+
+    # a hash of the schema the db is built with. an incremental load can only update a db that has the same schema
+    return combine_digests((sql_file, hashlib.sha256(resources.read_binary("msc_takehome.sql", sql_file)).digest())
+                           for sql_file in SCHEMA_FILES).hexdigest()
+
+
+def input_fingerprint(data_dir=None, materialize_reports=False):
+
+    # a hash of everything that goes into building the db: the input files, the schema, and whether reports are
+    # materialized. if it matches the one stamped on an existing db, rebuilding would produce the same data
+    digests = []
+
+    for file_name, _, _ in INPUTS.values():
+
+        if data_dir is None:
+            f = resources.open_binary("msc_takehome.data", file_name)
+        else:
+            f = open(os.path.join(data_dir, file_name), "rb")
+
+        with f:
+            digests.append((file_name, file_digest(f)))
+
+    fingerprint = combine_digests(digests)
+    fingerprint.update(schema_fingerprint().encode())
+    fingerprint.update(b"materialized" if materialize_reports else b"")
+
+    return fingerprint.hexdigest()
+
+
+def get_metadata(db_file, key):
+
+    # a value from the db's etl_metadata, or None if the db doesn't exist or doesn't have one
+    if not os.path.exists(db_file):
+        return None
+
+    try:
+        with closing(sqlite3.connect("{}?mode=ro".format(Path(db_file).absolute().as_uri()), uri=True)) as conn:
+            row = conn.execute("select value from etl_metadata where key = ?", [key]).fetchone()
+    except sqlite3.DatabaseError:
+        return None
+
+    return row[0] if row else None
+
+
+def get_input_fingerprint(db_file):
+
+    # the fingerprint of the inputs the db was last built from, or None if it wasn't stamped with one
+    return get_metadata(db_file, "input_fingerprint")
+
+
+def get_schema_fingerprint(db_file):
+
+    return get_metadata(db_file, "schema_fingerprint")
+
 
-    # if db already exists, make a backup of the former db and create a new one
-    if db_file_path.exists():
+def set_input_fingerprint(cursor, fingerprint):
 
-        now = datetime.now().strftime("%Y%m%d%H%M%S")
-        db_file_path.rename("{}.{}.bak".format(db_file, now))
+    cursor.execute("insert or replace into etl_metadata (key, value) values ('input_fingerprint', ?)", [fingerprint])
 
-    db_file_path.touch()
+
+def set_schema_fingerprint(cursor):
+
+    cursor.execute("insert or replace into etl_metadata (key, value) values ('schema_fingerprint', ?)", [schema_fingerprint()])
 
 
 def expand_name_fn(df, name_col=None):
@@ -53,6 +213,44 @@ def expand_name_fn(df, name_col=None):
     return df
 
 
+def expand_names(names):
+
+    # vectorized equivalent of `expand_name_fn`: takes a Series of names and returns a DataFrame (with the same index)
+    # containing first_name, middle_name, and last_name columns. names that don't match any known style are left as None
+    parts = names.str.extract(NAME_PATTERN)
+
+    expanded = pd.DataFrame({
+        "first_name": parts["fl_first"].fillna(parts["fml_first"]).fillna(parts["f_first"]).fillna(parts["lf_first"]).fillna(parts["lfm_first"]),
+        "middle_name": parts["fml_middle"].fillna(parts["lfm_middle"]),
+        "last_name": parts["fl_last"].fillna(parts["fml_last"]).fillna(parts["lf_last"]).fillna(parts["lfm_last"])
+    }, index=names.index)
+
+    # str.extract fills in unmatched groups with NaN, but the rest of the etl (and sqlite) expects None
+    return expanded.astype(object).where(expanded.notna(), None)
+
+
+# string columns with no more than this fraction of distinct values (eg instruments and sections) are dictionary encoded
+CATEGORICAL_MAX_RATIO = 0.5
+
+
+def lower_column(values):
+
+    # lowercases a column of strings. a column that repeats the same few values (eg section) is turned into a categorical,
+    # so that each distinct value is only lowercased (and stored) once, rather than once per row. anything done to the
+    # column later through the .str accessor (eg splitting names in expand_names) is also only done once per value
+    codes, uniques = pd.factorize(values)
+
+    # (a column with no values at all, eg one that's entirely null, has nothing to encode)
+    if not len(uniques) or len(uniques) > len(values) * CATEGORICAL_MAX_RATIO:
+        return values.str.lower()
+
+    # values that only differ by case are the same value once lowercased
+    lowered_codes, categories = pd.factorize(uniques.str.lower())
+    codes = np.where(codes < 0, -1, lowered_codes[codes])
+
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index, name=values.name)
+
+
 def pre_process_df(df):
 
     for column in df:
@@ -61,11 +259,270 @@ def pre_process_df(df):
         # NOTE: pandas classifies string columns as being "object" columns - but many other types can be objects as well! For instance, pandas will classify lists and dictionaries as objects too. To add insult to injury, attempting to use the .str accessor and str methods on these types won't throw any noticeable Exception - it will just return NaN!
         # for now, I'm going to leave this be, since I know that I'll always be operating on string data within the columns that I'm reading. However, if I was writing this to be a more general fn that was to be applied to unknown or variable data, I would need to think harder about this, and how to better distinguish "true" string data from other objects in the dataframe
         if df[column].dtype == "object":
-            df[column] = df[column].str.lower()
+            df[column] = lower_column(df[column])
 
     return df
 
 
+def read_csv_chunks(f, chunk_size=None, **kwargs):
+
+    # with no chunk_size, the whole file is read as a single frame. otherwise, frames of at most chunk_size rows are
+    # yielded one at a time, so that only one chunk of the file needs to be held in memory at once
+    if chunk_size is None:
+        yield pd.read_csv(f, **kwargs)
+
+    else:
+        with pd.read_csv(f, chunksize=chunk_size, **kwargs) as reader:
+            for df in reader:
+                yield df
+
+
+def timed_chunks(stage, chunks):
+
+    # records how long each chunk takes to produce (eg how long each chunk of a file takes to parse) against `stage`
+    chunks = iter(chunks)
+
+    while True:
+
+        start = time.perf_counter()
+        df = next(chunks, None)
+
+        if df is None:
+            return
+
+        stage_timer.add(stage, time.perf_counter() - start, len(df))
+        yield df
+
+
+def read_instruments(f, chunk_size=None):
+
+    for df in timed_chunks("parse_instruments", read_csv_chunks(f, chunk_size, delimiter=",", index_col=False)):
+
+        with stage_timer.time("preprocess_instruments", len(df)):
+            df = pre_process_df(df)
+
+        yield df
+
+
+def read_names(f, chunk_size=None):
+
+    for df in timed_chunks("parse_names", read_csv_chunks(f, chunk_size, delimiter="\t", index_col=False, names=["Name"])):
+
+        with stage_timer.time("preprocess_names", len(df)):
+            df = pre_process_df(df)
+            df = expand_names(df["Name"])
+
+        yield df
+
+
+def read_assignments(f, chunk_size=None):
+
+    for df in timed_chunks("parse_assignments_by_name", read_csv_chunks(f, chunk_size, delimiter=",", index_col=False)):
+
+        with stage_timer.time("preprocess_assignments_by_name", len(df)):
+            df = pre_process_df(df)
+            df = df[["Instrument"]].join(expand_names(df["Name"]))
+
+        yield df
+
+
+# the input file that each table is loaded from, the fn that parses it, and whether the file starts with a header line
+INPUTS = {
+    "instruments": ("instruments.csv", read_instruments, True),
+    "names": ("names.txt", read_names, False),
+    "assignments_by_name": ("name_instrument.csv", read_assignments, True)
+}
+
+# number of lines per shard when parsing in parallel without a chunk_size
+DEFAULT_SHARD_SIZE = 100000
+
+
+def read_input(data_dir, table, chunk_size=None):
+
+    file_name, reader, _ = INPUTS[table]
+
+    with open_input(data_dir, file_name) as f:
+        yield from reader(f, chunk_size)
+
+
+def parse_shard(table, text):
+
+    # runs in a worker process: parses a shard of an input file (including the file's header line, if it has one), and
+    # returns it along with the stage timings for parsing it, to be added to those of the etl run
+    _, reader, _ = INPUTS[table]
+
+    stage_timer.reset()
+    df = next(reader(io.StringIO(text)))
+
+    return df, stage_timer.stages
+
+
+def shard_result(future):
+
+    df, stages = future.result()
+    stage_timer.merge(stages)
+
+    return df
+
+
+def read_input_parallel(executor, data_dir, table, shard_size, window):
+
+    # splits an input file into shards of shard_size lines, and has `executor` parse them, with at most `window` shards
+    # submitted and not yet handed back at a time, so that only a bounded part of the file is held in memory at once. the
+    # first window is submitted right away, and the returned generator hands back results in file order, submitting the
+    # next shard as each one is taken.
+    # NOTE: this assumes one record per line, ie no quoted values spanning multiple lines, which holds for our input files
+    file_name, _, has_header = INPUTS[table]
+    f = open_input(data_dir, file_name)
+
+    header = f.readline() if has_header else ""
+    shards = (header + "".join(lines)
+              for lines in iter(lambda: list(itertools.islice(f, shard_size)), [])
+              if any(line.strip() for line in lines))
+
+    pending = deque(executor.submit(parse_shard, table, text) for text in itertools.islice(shards, window))
+
+    def results():
+
+        with f:
+            while pending:
+
+                df = shard_result(pending.popleft())
+
+                for text in itertools.islice(shards, 1):
+                    pending.append(executor.submit(parse_shard, table, text))
+
+                yield df
+
+    return results()
+
+
+# number of shards of each input file to have parsing (or parsed, and waiting to be loaded) at once, per worker
+SHARDS_PER_WORKER = 2
+
+
+def read_inputs(data_dir, chunk_size=None, executor=None, workers=None):
+
+    # the parsed chunks of each input file, by table. with an executor (of `workers` processes), the first few shards of
+    # every file are submitted for parsing before any of them are consumed, so that all of the files are parsed at once,
+    # across all of the executor's workers. after that, a file's next shard is only submitted as one of its shards is taken
+    if executor is None:
+        return {table: read_input(data_dir, table, chunk_size) for table in INPUTS}
+
+    return {table: read_input_parallel(executor, data_dir, table, chunk_size or DEFAULT_SHARD_SIZE, SHARDS_PER_WORKER * workers)
+            for table in INPUTS}
+
+
+# trade durability for speed while bulk loading: a crash mid-load would only lose the temporary file the new db is being
+# built in, since it's only swapped in for the current db once it's complete
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY"
+]
+
+# the first and middle names of each musician, each paired with their last name (or 'UNDEFINED', if they don't have one)
+NAME_KEYS_SQL = """
+    SELECT id, 0, first_name, COALESCE(last_name, 'UNDEFINED')
+    FROM names
+    UNION ALL
+    SELECT id, 1, middle_name, COALESCE(last_name, 'UNDEFINED')
+    FROM names
+    WHERE middle_name IS NOT NULL
+    ORDER BY 1, 2
+"""
+
+# the name each assignments_by_name entry refers to a musician by. if an assignment only has an initial for a first name,
+# the musician is referred to by their middle name instead
+NORMALIZED_ASSIGNMENTS_SQL = """
+    WITH normalized_assignments as (
+    SELECT
+    id,
+    instrument,
+    first_name,
+    middle_name,
+    last_name AS raw_last_name,
+    CASE
+    WHEN first_name LIKE '_.' THEN middle_name
+    WHEN first_name LIKE '_' THEN middle_name
+    ELSE first_name
+    END AS nick_name,
+    COALESCE (last_name, 'UNDEFINED') AS last_name
+    FROM assignments_by_name
+    )
+"""
+
+# matches each assignments_by_name entry up with the names/instruments entries it refers to, producing the
+# (player_id, instrument_id) rows of the assignments table. first name matches come before middle name matches, each in
+# the order they were listed in name_instrument.csv
+ASSIGNMENTS_SQL = NORMALIZED_ASSIGNMENTS_SQL + """
+    SELECT k.player_id, i.id
+    FROM normalized_assignments a
+    INNER JOIN name_keys k
+    ON k.nick_name = a.nick_name
+    AND k.last_name = a.last_name
+    INNER JOIN instruments i
+    ON i.instrument = a.instrument
+    ORDER BY k.name_part, a.id, i.section, i.id, k.player_id
+"""
+
+# assignments_by_name entries that don't match up with any musician and/or instrument
+UNMATCHED_ASSIGNMENTS_SQL = NORMALIZED_ASSIGNMENTS_SQL + """
+    SELECT a.instrument, a.first_name, a.middle_name, a.raw_last_name
+    FROM normalized_assignments a
+    WHERE NOT EXISTS (
+    SELECT 1
+    FROM name_keys k
+    INNER JOIN instruments i
+    ON i.instrument = a.instrument
+    WHERE k.nick_name = a.nick_name
+    AND k.last_name = a.last_name
+    )
+    ORDER BY a.id
+"""
+
+
+def link_assignments(cursor):
+
+    # create db relationships between assignments_by_name entries and names/instruments tables, and return the
+    # assignments_by_name entries that couldn't be linked
+    cursor.execute("INSERT INTO name_keys (player_id, name_part, nick_name, last_name)" + NAME_KEYS_SQL)
+    cursor.execute("INSERT INTO assignments (player_id, instrument_id)" + ASSIGNMENTS_SQL)
+
+    return report_unmatched_assignments(cursor)
+
+
+def report_unmatched_assignments(cursor):
+
+    unmatched = cursor.execute(UNMATCHED_ASSIGNMENTS_SQL).fetchall()
+
+    for instrument, first_name, middle_name, last_name in unmatched:
+        logger.warning("could not link assignment of %s to %s",
+                       instrument,
+                       " ".join(name for name in (first_name, middle_name, last_name) if name))
+
+    return unmatched
+
+
+def open_input(data_dir, file_name):
+
+    # input files are read from the data bundled with the package, unless a directory to read them from is given
+    if data_dir is None:
+        return resources.open_text("msc_takehome.data", file_name)
+
+    return open(os.path.join(data_dir, file_name))
+
+
+def worker_pool(workers):
+
+    # a process pool to parse the input files with, or a stand-in (yielding None) if the files are to be parsed serially
+    if workers:
+        return ProcessPoolExecutor(max_workers=workers)
+
+    return nullcontext()
+
+
 def load_df(conn, cursor, df, sql):
 
     records = df.to_records(index=False)
@@ -73,83 +530,371 @@ def load_df(conn, cursor, df, sql):
     conn.commit()
 
 
-def db_setup(db_file):
+def load_stats(num_rows, start):
 
-    # initialize db
-    create_db_file(db_file)
+    seconds = time.perf_counter() - start
+
+    return {"rows": num_rows, "seconds": seconds, "rows_per_second": num_rows / seconds if seconds else 0.0}
+
+
+def bulk_load(cursor, chunks, sql):
+
+    # feeds every row of every chunk to a single executemany, straight from the parser, without committing along the way
+    # or building an intermediate record array per chunk
+    start = time.perf_counter()
+    num_rows = [0]
+
+    def rows():
+        for df in chunks:
+            num_rows[0] += len(df)
+            yield from df.itertuples(index=False, name=None)
+
+    cursor.executemany(sql, rows())
+
+    return load_stats(num_rows[0], start)
+
+
+def sql_statements(script):
+
+    # splits a sql script up into its statements, so that they can be run inside of a transaction (which
+    # cursor.executescript would commit)
+    statement = ""
+
+    for line in script.splitlines(keepends=True):
+
+        statement += line
+
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ""
+
+
+def input_seconds(table):
+
+    # time spent so far this etl run producing the parsed chunks of a table's input file
+    return stage_timer.seconds("parse_{}".format(table)) + stage_timer.seconds("preprocess_{}".format(table))
+
+
+def save_stage_timings(cursor):
+
+    # stores the stage timings of this etl run in the db, where anything serving reports from it can find them
+    for stage, totals in stage_timer.stages.items():
+        logger.info("etl stage %s: %d rows in %.3fs over %d calls", stage, totals["rows"], totals["seconds"], totals["calls"])
+
+    cursor.execute("insert or replace into etl_metadata (key, value) values ('etl_stages', ?)", [json.dumps(stage_timer.stages)])
+
+
+def check_integrity(cursor):
+
+    problems = [row[0] for row in cursor.execute("PRAGMA quick_check").fetchall() if row[0] != "ok"]
+    problems += ["{} row {} has no matching {} row".format(table, rowid, parent)
+                 for table, rowid, parent, _ in cursor.execute("PRAGMA foreign_key_check").fetchall()]
+
+    if problems:
+        raise sqlite3.IntegrityError("; ".join(problems))
+
+
+def sync_table(cursor, table, columns, rows, key=None, index=None):
+
+    # brings `table` in line with `rows` (a list of tuples of `columns` values), only touching the rows that differ.
+    # rows are compared as a multiset, since nothing stops the same name from appearing twice in the roster. rows that no
+    # longer exist are deleted, and new rows are inserted with new ids, so that an id is never handed on to a different
+    # row. with `key` (the columns that identify a row, eg an instrument's name), a row whose key still exists but whose
+    # other values changed (eg an instrument that moved to another section) is updated in place instead, keeping its id.
+    # with `index` (an external content full text index over `columns`), the rows that changed are changed in it too
+    existing = cursor.execute("SELECT id, {} FROM {} ORDER BY id".format(", ".join(columns), table))
+
+    unmatched = Counter(rows)
+    stale = []
+
+    for row_id, *values in existing.fetchall():
+
+        values = tuple(values)
+
+        if unmatched[values] > 0:
+            unmatched[values] -= 1
+        else:
+            stale.append((row_id, values))
+
+    new_rows = []
+
+    for row in rows:
+
+        if unmatched[row] > 0:
+            unmatched[row] -= 1
+            new_rows.append(row)
+
+    # the ids of the stale rows with each key, in id order, to be paired up with new rows with the same key
+    key_indexes = [columns.index(col) for col in key or []]
+    stale_ids_by_key = {}
+
+    if key:
+        for row_id, values in stale:
+            stale_ids_by_key.setdefault(tuple(values[i] for i in key_indexes), []).append(row_id)
+
+    updates = []
+    inserts = []
+
+    for row in new_rows:
+
+        stale_ids = stale_ids_by_key.get(tuple(row[i] for i in key_indexes))
+
+        if stale_ids:
+            updates.append(row + (stale_ids.pop(0),))
+        else:
+            inserts.append(row)
+
+    updated_ids = {update[-1] for update in updates}
+    deletes = [(row_id,) for row_id, _ in stale if row_id not in updated_ids]
+
+    cursor.executemany("DELETE FROM {} WHERE id = ?".format(table), deletes)
+    cursor.executemany(
+        "UPDATE {} SET {} WHERE id = ?".format(table, ", ".join("{} = ?".format(col) for col in columns)),
+        updates
+    )
+
+    # ids are autoincremented, so the inserted rows are the ones after the highest id left once the deletes are done
+    last_id = cursor.execute("SELECT coalesce(max(id), 0) FROM {}".format(table)).fetchone()[0]
+
+    cursor.executemany(
+        "INSERT INTO {}({}) VALUES ({})".format(table, ", ".join(columns), ", ".join("?" for _ in columns)),
+        inserts
+    )
+
+    if index is not None:
+        removed = [(row_id,) + values for row_id, values in stale]
+        added = [(update[-1],) + update[:-1] for update in updates]
+        added += cursor.execute("SELECT id, {} FROM {} WHERE id > ?".format(", ".join(columns), table), [last_id]).fetchall()
+
+        update_search_index(cursor, index, columns, removed, added)
+
+    return {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deletes)
+    }
+
+
+def db_update(db_file, chunk_size=None, data_dir=None, materialize_reports=False, workers=None, fingerprint=None):
+
+    # incrementally brings an existing db in line with the input files, rather than rebuilding it from scratch. rows that
+    # haven't changed (and their ids) are left alone. returns the number of rows inserted/updated/deleted per table
+    def rows(chunks):
+        return [row for df in chunks for row in df.itertuples(index=False, name=None)]
+
+    stage_timer.reset()
+
+    with worker_pool(workers) as executor:
+        inputs = read_inputs(data_dir, chunk_size, executor, workers)
+
+        instruments = rows(inputs["instruments"])
+        names = rows(inputs["names"])
+        assignments = rows(inputs["assignments_by_name"])
 
     with closing(sqlite3.connect(db_file)) as conn:
         with closing(conn.cursor()) as cursor:
 
-            cursor.executescript(resources.read_text("msc_takehome.sql", "create_schema_sqlite.sql"))
+            changes = {}
+
+            # the search indexes are kept in step with the rows that change, rather than rebuilt
+            with stage_timer.time("sync_instruments", len(instruments)):
+                changes["instruments"] = sync_table(cursor, "instruments", ["instrument", "section"], instruments,
+                                                    key=["instrument"], index=SEARCHES["instruments"]["index"])
+
+            with stage_timer.time("sync_names", len(names)):
+                changes["names"] = sync_table(cursor, "names", ["first_name", "middle_name", "last_name"], names,
+                                              index=SEARCHES["musicians"]["index"])
+
+            with stage_timer.time("sync_assignments_by_name", len(assignments)):
+                changes["assignments_by_name"] = sync_table(cursor,
+                                                            "assignments_by_name",
+                                                            ["instrument", "first_name", "middle_name", "last_name"],
+                                                            assignments)
+
+            # re-derive the relationships from the updated tables, and only write the ones that changed
+            with stage_timer.time("link_assignments"):
+                changes["name_keys"] = sync_table(cursor,
+                                                  "name_keys",
+                                                  ["player_id", "name_part", "nick_name", "last_name"],
+                                                  cursor.execute(NAME_KEYS_SQL).fetchall())
+                changes["assignments"] = sync_table(cursor,
+                                                    "assignments",
+                                                    ["player_id", "instrument_id"],
+                                                    cursor.execute(ASSIGNMENTS_SQL).fetchall())
+                report_unmatched_assignments(cursor)
+
+            changed = any(sum(table_changes.values()) for table_changes in changes.values())
+
+            # the report snapshots are only rewritten if the data changed, or if they're being turned on or off
+            if changed or not report_tables_match(cursor, materialize=materialize_reports):
+                with stage_timer.time("refresh_reports"):
+                    refresh_report_tables(cursor, materialize=materialize_reports)
+
+            if changed:
+                set_db_version(cursor)
+
+            if fingerprint is not None:
+                set_input_fingerprint(cursor, fingerprint)
+
+            save_stage_timings(cursor)
             conn.commit()
 
-            # instruments ETL
-            with resources.open_text("msc_takehome.data", "instruments.csv") as instruments:
-                instruments_df = pre_process_df(pd.read_csv(instruments, delimiter=",", index_col=False))
-                load_df(conn,
-                        cursor,
-                        instruments_df,
-                        "INSERT INTO instruments(instrument, section) VALUES (?, ?)")
-
-            # names ETL
-            with resources.open_text("msc_takehome.data", "names.txt") as names:
-                names_df = pre_process_df(pd.read_csv(names, delimiter="\t", index_col=False, names=["Name"]))
-                names_df["first_name"], names_df["middle_name"], names_df["last_name"] = [None, None, None]
-                names_df = names_df.apply(expand_name_fn, axis=1, name_col="Name")
-                load_df(conn,
-                        cursor,
-                        names_df[["first_name", "middle_name", "last_name"]],
-                        "INSERT INTO names(first_name, middle_name, last_name) VALUES (?, ?, ?)")
-
-            # assignments_by_name ETL
-            with resources.open_text("msc_takehome.data", "name_instrument.csv") as name_instruments:
-                assignments_df = pre_process_df(pd.read_csv(name_instruments, delimiter=",", index_col=False))
-                assignments_df["first_name"], assignments_df["middle_name"], assignments_df["last_name"] = [None, None, None]
-                assignments_df = assignments_df.apply(expand_name_fn, axis=1, name_col="Name")
-                load_df(conn,
-                        cursor,
-                        assignments_df[["Instrument", "first_name", "middle_name", "last_name"]],
-                        "INSERT INTO assignments_by_name(instrument, first_name, middle_name, last_name) VALUES (?, ?, ?, ?)")
-
-            # create db relationships between assignments_by_name entries and names/instruments tables
-            assignments_sql = [
-                """
-                INSERT INTO assignments (player_id, instrument_id)
-                WITH normalized_assignments as (
-                SELECT
-                instrument,
-                CASE
-	            WHEN first_name LIKE ? THEN middle_name
-	            WHEN first_name LIKE ? THEN middle_name
-	            ELSE first_name
-                END AS nick_name,
-                COALESCE (last_name, 'UNDEFINED') AS last_name
-                FROM assignments_by_name
-                )
-                -- handle assignments where n.first_name / n.last_name is used
-                SELECT n.id, i.id
-                FROM normalized_assignments a
-                INNER JOIN names n, instruments i
-                ON n.first_name = a.nick_name
-                AND COALESCE(n.last_name, 'UNDEFINED') = a.last_name
-                AND i.instrument = a.instrument
-                UNION ALL
-                -- handle assignments where n.middle_name / n.last_name is used
-                SELECT n.id, i.id
-                FROM normalized_assignments a
-                INNER JOIN names n, instruments i
-                ON n.middle_name = a.nick_name
-                AND COALESCE(n.last_name, 'UNDEFINED') = a.last_name
-                AND i.instrument = a.instrument;
-                """,
-                ["_.", "_"]  # list of query params
-            ]
-
-            cursor.execute(*assignments_sql)
-            conn.commit()
+    return changes
+
+
+def db_setup(db_file, chunk_size=None, data_dir=None, incremental=False, materialize_reports=False, bulk=False, workers=None,
+             skip_unchanged=False, backups=3):
+
+    # with bulk=True, the load runs as a single transaction with durability relaxed, indexes are only built once the data
+    # is loaded, and the db is integrity checked at the end. returns the rows loaded per table and how long they took.
+    # with workers, the input files are parsed in parallel by that many processes, while this process writes to the db.
+    # with skip_unchanged=True, nothing is done if the db was already built from the same inputs. a rebuilt db replaces
+    # the current one, which is backed up first; only the last `backups` backups are kept
+
+    stage_timer.reset()
+
+    fingerprint = input_fingerprint(data_dir, materialize_reports)
+
+    if skip_unchanged and get_input_fingerprint(db_file) == fingerprint:
+        logger.info("%s is up to date with its inputs, skipping the etl", db_file)
+        return None
+
+    # an incremental load only writes rows, so a db built with a different schema (or from before schemas were stamped
+    # on the db) is rebuilt from scratch instead
+    if incremental and Path(db_file).exists() and get_schema_fingerprint(db_file) != schema_fingerprint():
+        logger.info("%s was built with a different schema, rebuilding it rather than updating it", db_file)
+        incremental = False
+
+    if incremental and Path(db_file).exists():
+        return db_update(db_file,
+                         chunk_size=chunk_size,
+                         data_dir=data_dir,
+                         materialize_reports=materialize_reports,
+                         workers=workers,
+                         fingerprint=fingerprint)
+
+    # initialize db
+    build_file = create_db_file(db_file)
+
+    stats = {}
+    indexes_sql = resources.read_text("msc_takehome.sql", "create_indexes_sqlite.sql")
+
+    with worker_pool(workers) as executor:
+
+        # with a worker pool, parsing starts right away, and carries on in the background while the schema is created
+        inputs = read_inputs(data_dir, chunk_size, executor, workers)
+
+        with closing(sqlite3.connect(build_file)) as conn:
+            with closing(conn.cursor()) as cursor:
+
+                with stage_timer.time("create_schema"):
+                    cursor.executescript(resources.read_text("msc_takehome.sql", "create_schema_sqlite.sql"))
+
+                    if not bulk:
+                        cursor.executescript(indexes_sql)
+
+                    conn.commit()
+
+                if bulk:
+                    for pragma in BULK_LOAD_PRAGMAS:
+                        cursor.execute(pragma)
+
+                    cursor.execute("BEGIN")
+
+                def load(table, chunks, sql):
+
+                    if bulk:
+                        # parsing happens as part of the bulk load, so its time is taken back out of the load stage
+                        parsed_before = input_seconds(table)
+                        stats[table] = bulk_load(cursor, chunks, sql)
+                        stage_timer.add("load_{}".format(table),
+                                        stats[table]["seconds"] - (input_seconds(table) - parsed_before),
+                                        stats[table]["rows"])
+
+                    else:
+                        for df in chunks:
+                            with stage_timer.time("load_{}".format(table), len(df)):
+                                load_df(conn, cursor, df, sql)
+
+                # instruments ETL
+                load("instruments",
+                     inputs["instruments"],
+                     "INSERT INTO instruments(instrument, section) VALUES (?, ?)")
+
+                # names ETL
+                load("names",
+                     inputs["names"],
+                     "INSERT INTO names(first_name, middle_name, last_name) VALUES (?, ?, ?)")
+
+                # assignments_by_name ETL
+                load("assignments_by_name",
+                     inputs["assignments_by_name"],
+                     "INSERT INTO assignments_by_name(instrument, first_name, middle_name, last_name) VALUES (?, ?, ?, ?)")
+
+                if bulk:
+                    # the indexes are built in one go over the loaded data (and before the link, which looks things up by them)
+                    with stage_timer.time("create_indexes"):
+                        for statement in sql_statements(indexes_sql):
+                            cursor.execute(statement)
+
+                start = time.perf_counter()
+                link_assignments(cursor)
+                stats["assignments"] = load_stats(cursor.execute("SELECT count(*) FROM assignments").fetchone()[0], start)
+                stage_timer.add("link_assignments", stats["assignments"]["seconds"], stats["assignments"]["rows"])
+                conn.commit()
+
+                with stage_timer.time("build_search_index"):
+                    rebuild_search_index(cursor)
+
+                with stage_timer.time("refresh_reports"):
+                    refresh_report_tables(cursor, materialize=materialize_reports)
+
+                set_db_version(cursor)
+                set_input_fingerprint(cursor, fingerprint)
+                set_schema_fingerprint(cursor)
+                save_stage_timings(cursor)
+                conn.commit()
+
+                if bulk:
+                    cursor.execute("PRAGMA synchronous = FULL")
+                    check_integrity(cursor)
+
+                    for table, table_stats in stats.items():
+                        logger.info("loaded %d rows into %s in %.3fs (%.0f rows/s)",
+                                    table_stats["rows"], table, table_stats["seconds"], table_stats["rows_per_second"])
+
+                # let the web tier's readers keep reading while later (incremental) etl runs write to the db
+                cursor.execute("PRAGMA journal_mode = WAL")
+
+    swap_db_file(build_file, db_file, backups)
+
+    return stats if bulk else None
+
+
+def setup_ensembles(ensembles, processes=None, **kwargs):
+
+    # runs the etl for each ensemble (see Config.ENSEMBLES) into its own db, with up to `processes` ensembles loading at
+    # once, each in its own process. kwargs are passed on to each ensemble's db_setup. returns each ensemble's result
+    if not ensembles:
+        return {}
+
+    with ProcessPoolExecutor(max_workers=processes or len(ensembles)) as executor:
+
+        futures = {ensemble: executor.submit(db_setup, shard["db_file"], data_dir=shard.get("data_dir"), **kwargs)
+                   for ensemble, shard in ensembles.items()}
+
+        return {ensemble: future.result() for ensemble, future in futures.items()}
 
 
 if __name__ == '__main__':
 
-    db_setup(os.environ.get("DB_FILE", "orchestra.db"))
+    chunk_size = os.environ.get("ETL_CHUNK_SIZE")
+    db_setup(os.environ.get("DB_FILE", "orchestra.db"),
+             chunk_size=int(chunk_size) if chunk_size else None,
+             data_dir=os.environ.get("ETL_DATA_DIR"),
+             incremental=os.environ.get("ETL_INCREMENTAL", "") == "1",
+             materialize_reports=os.environ.get("MATERIALIZE_REPORTS", "") == "1",
+             bulk=os.environ.get("ETL_BULK_LOAD", "") == "1",
+             workers=int(os.environ.get("ETL_WORKERS", 0)) or None,
+             skip_unchanged=os.environ.get("ETL_SKIP_UNCHANGED", "") == "1",
+             backups=int(os.environ.get("DB_BACKUPS", 3)))
@@ -0,0 +1,109 @@
+from operator import itemgetter
+import csv
+import io
+import json
+import zlib
+
+# arrow export is only available when pyarrow is installed
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def project(columns, batches, selected):
+
+    # narrows each batch of rows down to the selected columns, in the order they were asked for
+    unknown = [col for col in selected if col not in columns]
+
+    if unknown:
+        raise ValueError("unknown columns: {}".format(", ".join(unknown)))
+
+    indexes = [columns.index(col) for col in selected]
+
+    if len(indexes) == 1:
+        getter = lambda row, i=indexes[0]: (row[i],)
+    else:
+        getter = itemgetter(*indexes)
+
+    return list(selected), ([getter(row) for row in batch] for batch in batches)
+
+
+def csv_chunks(columns, batches):
+
+    # a header line, followed by one chunk of lines per batch. None is written out as an empty field
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+
+    for batch in batches:
+
+        writer.writerows(batch)
+
+        yield buffer.getvalue().encode()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+    # the header, if there were no rows
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(columns, batches):
+
+    # one json object per row, keyed by column name
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in batch).encode()
+
+
+def arrow_chunks(columns, batches):
+
+    # an arrow ipc stream: the schema, then one record batch per batch of rows. every column of every report is text
+    schema = pa.schema([(col, pa.string()) for col in columns])
+    sink = io.BytesIO()
+
+    def drain():
+
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+
+        return data
+
+    writer = pa.ipc.new_stream(sink, schema)
+
+    for batch in batches:
+
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_arrays([pa.array(col, type=pa.string()) for col in zip(*batch)],
+                                                          schema=schema))
+            yield drain()
+
+    writer.close()
+
+    yield drain()
+
+
+def gzip_chunks(chunks, level=6):
+
+    # compresses the chunks as a single gzip stream, without holding the whole thing in memory
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+
+        data = compressor.compress(chunk)
+
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+# format -> (mimetype, encoder)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", csv_chunks),
+    "ndjson": ("application/x-ndjson", ndjson_chunks),
+    "arrow": ("application/vnd.apache.arrow.stream", arrow_chunks)
+}
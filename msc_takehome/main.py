@@ -1,8 +1,21 @@
-from etl import db_setup
+from etl import db_setup, setup_ensembles
 from routes import app
 
 
 if __name__ == '__main__':
 
-    db_setup(app.config.get("DB_FILE"))
+    options = dict(chunk_size=app.config.get("ETL_CHUNK_SIZE"),
+                   incremental=app.config.get("ETL_INCREMENTAL"),
+                   materialize_reports=app.config.get("MATERIALIZE_REPORTS"),
+                   bulk=app.config.get("ETL_BULK_LOAD"),
+                   workers=app.config.get("ETL_WORKERS"),
+                   skip_unchanged=app.config.get("ETL_SKIP_UNCHANGED"),
+                   backups=app.config.get("DB_BACKUPS"))
+
+    # each ensemble is loaded into its own db, in parallel
+    if app.config.get("ENSEMBLES"):
+        setup_ensembles(app.config.get("ENSEMBLES"), **options)
+    else:
+        db_setup(app.config.get("DB_FILE"), data_dir=app.config.get("ETL_DATA_DIR"), **options)
+
     app.run()
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from threading import Lock
+import time
+
+
+# latency buckets (in seconds) for the request histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+
+    if not labels:
+        return ""
+
+    escaped = ('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for name, value in labels)
+
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value):
+
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Histogram(object):
+    """
+    A prometheus-style histogram: the count of observations falling into each of a set of cumulative buckets, along with
+    their sum and total count, kept separately for each combination of label values
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+
+        self.name = name
+        self.help_text = help_text
+        self.label_names = list(label_names)
+        self.buckets = list(buckets) + [float("inf")]
+        self._series = {}
+        self._lock = Lock()
+
+
+    def observe(self, value, **labels):
+
+        key = tuple(labels[name] for name in self.label_names)
+
+        with self._lock:
+
+            series = self._series.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+
+            series["sum"] += value
+            series["count"] += 1
+
+
+    def count(self, **labels):
+
+        series = self._series.get(tuple(labels[name] for name in self.label_names))
+        return series["count"] if series else 0
+
+
+    def expose(self):
+
+        lines = ["# HELP {} {}".format(self.name, self.help_text), "# TYPE {} histogram".format(self.name)]
+
+        with self._lock:
+
+            for key, series in sorted(self._series.items()):
+
+                labels = list(zip(self.label_names, key))
+
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append("{}_bucket{} {}".format(self.name, format_labels(labels + [("le", format_value(bound))]), count))
+
+                lines.append("{}_sum{} {}".format(self.name, format_labels(labels), format_value(series["sum"])))
+                lines.append("{}_count{} {}".format(self.name, format_labels(labels), series["count"]))
+
+        return lines
+
+
+def expose_gauge(name, help_text, samples, metric_type="gauge"):
+
+    # samples is a list of (labels, value) pairs, where labels is a list of (name, value) pairs
+    lines = ["# HELP {} {}".format(name, help_text), "# TYPE {} {}".format(name, metric_type)]
+    lines += ["{}{} {}".format(name, format_labels(labels), format_value(value)) for labels, value in samples]
+
+    return lines
+
+
+class StageTimer(object):
+    """
+    Accumulates the time spent, rows processed, and number of calls for each stage of an etl run
+    """
+
+    def __init__(self):
+
+        self.stages = {}
+
+
+    def reset(self):
+
+        self.stages = {}
+
+
+    def add(self, stage, seconds, rows=0, calls=1):
+
+        totals = self.stages.setdefault(stage, {"seconds": 0.0, "rows": 0, "calls": 0})
+        totals["seconds"] += seconds
+        totals["rows"] += rows
+        totals["calls"] += calls
+
+
+    def merge(self, stages):
+
+        for stage, totals in stages.items():
+            self.add(stage, totals["seconds"], totals["rows"], totals["calls"])
+
+
+    def seconds(self, stage):
+
+        return self.stages.get(stage, {}).get("seconds", 0.0)
+
+
+    @contextmanager
+    def time(self, stage, rows=0):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, rows)
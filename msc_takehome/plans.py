@@ -0,0 +1,90 @@
+from contextlib import closing
+from msc_takehome.etl import NAME_KEYS_SQL, ASSIGNMENTS_SQL, UNMATCHED_ASSIGNMENTS_SQL
+from msc_takehome.reports import REPORT_VIEWS, KEYSET_QUERIES
+from msc_takehome.search import SEARCHES
+import sqlite3
+import sys
+
+
+# plan steps that are expected for a query, even though they read a whole table or sort: a report that lists every
+# musician has to read every name, for instance. any other full scan or sort in a query's plan is a regression
+ALLOWED_STEPS = {
+    # every musician is listed, so every name is read. each musician's instruments are then put in order, which only
+    # sorts the few assignments of one musician at a time
+    "all_musicians": ["SCAN n", "USE TEMP B-TREE FOR RIGHT PART OF ORDER BY"],
+    "all_musicians_page": ["USE TEMP B-TREE FOR RIGHT PART OF ORDER BY"],
+    # the etl derives name keys from every name, and links every assignments_by_name entry, in the order they were
+    # listed in name_instrument.csv (first name matches before middle name matches), which takes a sort
+    "link_name_keys": ["SCAN names"],
+    "link_assignments": ["SCAN assignments_by_name", "USE TEMP B-TREE FOR ORDER BY"],
+    "unmatched_assignments": ["SCAN assignments_by_name"],
+    # search results are ranked by bm25, so they can only be put in order once every match is scored
+    "search_musicians": ["USE TEMP B-TREE FOR ORDER BY"],
+    "search_instruments": ["USE TEMP B-TREE FOR ORDER BY"]
+}
+
+
+def checked_queries():
+
+    # every query whose plan is checked, by name: the report views, the queries that page through them, the etl's link
+    # queries, and the search queries
+    queries = {view_name: ("select * from {}".format(view_name), {}) for view_name in REPORT_VIEWS}
+
+    for view_name, query in KEYSET_QUERIES.items():
+        params = {"k{}".format(i + 1): k for i, k in enumerate(query["start"])}
+        params["limit"] = 100
+        queries["{}_page".format(view_name)] = (query["sql"], params)
+
+    queries["link_name_keys"] = (NAME_KEYS_SQL, {})
+    queries["link_assignments"] = (ASSIGNMENTS_SQL, {})
+    queries["unmatched_assignments"] = (UNMATCHED_ASSIGNMENTS_SQL, {})
+
+    for kind, search in SEARCHES.items():
+        queries["search_{}".format(kind)] = (search["sql"], {"query": '"a"*', "limit": 20, "offset": 0})
+
+    return queries
+
+
+def query_plan(conn, sql, params):
+
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def is_unindexed(step):
+
+    # a sort, a whole table read without an index, or an index sqlite had to build on the fly because there wasn't one
+    if step.startswith("USE TEMP B-TREE") or "AUTOMATIC" in step:
+        return True
+
+    return step.startswith("SCAN ") and not any(using in step for using in [" USING INDEX ", " USING COVERING INDEX ", " VIRTUAL TABLE "])
+
+
+def check_plans(conn, allowed=ALLOWED_STEPS):
+
+    # returns the unindexed steps that aren't allowed for each query that has any
+    problems = {}
+
+    for name, (sql, params) in checked_queries().items():
+
+        steps = [step for step in query_plan(conn, sql, params) if is_unindexed(step) and step not in allowed.get(name, [])]
+
+        if steps:
+            problems[name] = steps
+
+    return problems
+
+
+if __name__ == '__main__':
+
+    # prints the plan of every checked query against a db, and exits with an error if any of them regressed
+    with closing(sqlite3.connect(sys.argv[1])) as conn:
+
+        for name, (sql, params) in checked_queries().items():
+
+            print(name)
+
+            for step in query_plan(conn, sql, params):
+                flag = "!" if is_unindexed(step) and step not in ALLOWED_STEPS.get(name, []) else " "
+                print("  {} {}".format(flag, step))
+
+        sys.exit(1 if check_plans(conn) else 0)
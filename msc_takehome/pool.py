@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+from pathlib import Path
+import threading
+import sqlite3
+import queue
+import os
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection is returned to a ConnectionPool in time for a borrower that is waiting on one
+    """
+
+
+class ConnectionPool(object):
+    """
+    Hands out read-only connections to a db file. a connection is borrowed for a request, and returned to the pool once
+    the request is done with it, to be reused by whichever thread needs one next, so that a request doesn't pay to open
+    (and tune) a connection of its own. at most max_size connections are open at once: once they're all borrowed, the
+    next borrower waits up to `timeout` seconds for one to be returned. the etl puts the db in WAL mode, so these readers
+    aren't blocked while it writes.
+
+    a full etl run copies the rebuilt db into the db file in place, which these connections see from their next query on.
+    if the db file is replaced by a different file, though, connections opened on the previous file (or from before
+    close_all) are closed as they come back to the pool, rather than reused
+    """
+
+    def __init__(self, db_file, cache_size_kb=65536, mmap_size=268435456, max_size=16, timeout=30):
+
+        self.db_file = db_file
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.max_size = max_size
+        self.timeout = timeout
+        # the most recently returned connection is handed out first, so that a quiet pool keeps reusing the same one
+        self._idle = queue.LifoQueue()
+        self._available = threading.BoundedSemaphore(max_size)
+        # every open connection, borrowed or idle, along with the file and generation it was opened on
+        self._connections = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+
+        return len(self._connections)
+
+
+    def _connect(self, file_id):
+
+        conn = sqlite3.connect("{}?mode=ro".format(Path(self.db_file).absolute().as_uri()), uri=True, check_same_thread=False)
+
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute("PRAGMA cache_size = -{}".format(int(self.cache_size_kb)))
+        conn.execute("PRAGMA mmap_size = {}".format(int(self.mmap_size)))
+
+        with self._lock:
+            self._connections[conn] = (file_id, self._generation)
+
+        return conn
+
+
+    def _close(self, conn):
+
+        with self._lock:
+            self._connections.pop(conn, None)
+
+        conn.close()
+
+
+    def _is_current(self, conn, file_id):
+
+        with self._lock:
+            return self._connections.get(conn) == (file_id, self._generation)
+
+
+    def acquire(self):
+
+        # an idle connection if there is one that's still on the current db file, otherwise a new one
+        if not self._available.acquire(timeout=self.timeout):
+            raise PoolTimeout("no connection to {} was returned within {}s".format(self.db_file, self.timeout))
+
+        try:
+            file_id = os.stat(self.db_file).st_ino
+
+            while True:
+
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect(file_id)
+
+                if self._is_current(conn, file_id):
+                    return conn
+
+                self._close(conn)
+
+        except BaseException:
+            self._available.release()
+            raise
+
+
+    def release(self, conn):
+
+        try:
+            if self._is_current(conn, os.stat(self.db_file).st_ino):
+                self._idle.put(conn)
+            else:
+                self._close(conn)
+        except OSError:
+            self._close(conn)
+        finally:
+            self._available.release()
+
+
+    @contextmanager
+    def connection(self):
+
+        conn = self.acquire()
+
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+
+    def close_all(self):
+
+        # closes every idle connection. connections that are borrowed at the time are closed when they're returned
+        with self._lock:
+            self._generation += 1
+
+        while True:
+
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+
+            self._close(conn)
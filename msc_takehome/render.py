@@ -0,0 +1,74 @@
+from html import escape
+import itertools
+
+
+# the markup around a report table, as produced by DataFrame.to_html(index=False)
+TABLE_HEAD = '<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n'
+TABLE_BODY = '    </tr>\n  </thead>\n  <tbody>\n'
+TABLE_FOOT = '  </tbody>\n</table>'
+
+
+def column_header(col):
+
+    # convert database col names to human friendly
+    return escape(col.replace("_", " ").title(), quote=False)
+
+
+def format_value(value):
+
+    # re-upper case strings, and convert `None` to empty string
+    if value is None:
+        return ""
+
+    if isinstance(value, str):
+        return escape(value.title(), quote=False)
+
+    return escape(str(value), quote=False)
+
+
+class FormattedValues(dict):
+    """
+    The formatted (title-cased and escaped) form of each value, worked out the first time that value is seen. sections,
+    instruments, and common names repeat a lot within a report, so this formats each distinct value once rather than
+    once per cell
+    """
+
+    def __missing__(self, value):
+
+        formatted = self[value] = format_value(value)
+        return formatted
+
+
+def html_table(columns, batches):
+
+    # renders a report as the same html that df.to_html(index=False) would (see process_report_df in the tests), but
+    # straight from the rows, a batch at a time, so that the rows never need to all be held in memory at once (and pandas isn't needed)
+    yield TABLE_HEAD + "".join("      <th>{}</th>\n".format(column_header(col)) for col in columns) + TABLE_BODY
+
+    # the markup for a row only depends on the number of columns, so it's built once up front
+    row_template = "    <tr>\n" + "      <td>{}</td>\n" * len(columns) + "    </tr>\n"
+
+    formatted = FormattedValues().__getitem__
+
+    for rows in batches:
+        yield "".join(row_template.format(*map(formatted, row)) for row in rows)
+
+    yield TABLE_FOOT
+
+
+def render_table(cursor):
+
+    return "".join(html_table([col[0] for col in cursor.description], cursor_batches(cursor)))
+
+
+def cursor_batches(cursor, batch_size=500):
+
+    return iter(lambda: cursor.fetchmany(batch_size), [])
+
+
+def row_batches(rows, batch_size=500):
+
+    # the same batches as cursor_batches, from any iterator of rows
+    rows = iter(rows)
+
+    return iter(lambda: list(itertools.islice(rows, batch_size)), [])
@@ -0,0 +1,201 @@
+from itertools import zip_longest
+import sqlite3
+import json
+import uuid
+from msc_takehome.config import Config
+
+
+REPORT_VIEWS = [report["view"] for report in Config.REPORTS]
+
+
+# for each report view, a query that fetches the page of the report following a given key. the leading columns of each
+# query are the key: the columns the view is ordered by, plus the assignment id as a tiebreaker, so that the key is unique
+# and a page can be found by seeking past the previous page's last key rather than with an OFFSET scan. where the view
+# orders by a joined id, the equivalent assignments column is used, so that the order comes straight off of an index
+KEYSET_QUERIES = {
+    "all_musicians": {
+        "start": [0, -1, -1],
+        "sql": """
+            select n.id, coalesce(i.id, 0), coalesce(a.id, 0),
+                   n.first_name, n.middle_name, n.last_name, i.instrument, i.section
+              from names n
+                   left join assignments a
+                       on n.id = a.player_id
+                   left join instruments i
+                       on i.id = a.instrument_id
+             where n.id >= :k1
+               and (n.id > :k1 or (coalesce(i.id, 0), coalesce(a.id, 0)) > (:k2, :k3))
+             order by n.id, coalesce(i.id, 0), coalesce(a.id, 0)
+             limit :limit
+        """
+    },
+    "instruments_without_musicians": {
+        "start": ["", 0],
+        "sql": """
+            select i.section, i.id,
+                   i.instrument, i.section
+              from instruments i
+             where i.section >= :k1
+               and (i.section > :k1 or i.id > :k2)
+               and not exists (select 1 from assignments a where a.instrument_id = i.id)
+             order by i.section, i.id
+             limit :limit
+        """
+    },
+    "multi_instrumentalists": {
+        "start": [0, 0, 0],
+        "sql": """
+            select a.player_id, a.instrument_id, a.id,
+                   n.first_name, n.middle_name, n.last_name, i.instrument, i.section
+              from names n
+                   inner join assignments a
+                       on n.id = a.player_id
+                   inner join instruments i
+                       on i.id = a.instrument_id
+             where a.player_id >= :k1
+               and (a.player_id > :k1 or (a.instrument_id, a.id) > (:k2, :k3))
+               and (select count(*) from assignments c where c.player_id = a.player_id) > 1
+             order by a.player_id, a.instrument_id, a.id
+             limit :limit
+        """
+    },
+    "multiple_players": {
+        "start": [0, 0, 0],
+        "sql": """
+            select a.instrument_id, a.player_id, a.id,
+                   i.instrument, i.section, n.first_name, n.middle_name, n.last_name
+              from instruments i
+                   inner join assignments a
+                       on i.id = a.instrument_id
+                   inner join names n
+                       on n.id = a.player_id
+             where a.instrument_id >= :k1
+               and (a.instrument_id > :k1 or (a.player_id, a.id) > (:k2, :k3))
+               and (select count(*) from assignments c where c.instrument_id = a.instrument_id) > 1
+             order by a.instrument_id, a.player_id, a.id
+             limit :limit
+        """
+    }
+}
+
+# materialized tables are filled in their view's order, so their rowid is all the key they need. the rowid is the key of
+# the table's own b-tree, so seeking past the previous page's last rowid is an index search, without a separate index
+MATERIALIZED_KEYSET_QUERY = {
+    "start": [0],
+    "sql": "select rowid, * from {table} where rowid > :k1 order by rowid limit :limit"
+}
+
+
+def get_db_version(conn):
+
+    # the version stamp written by the last etl run, or None if the db predates version stamps
+    try:
+        row = conn.execute("select value from etl_metadata where key = 'db_version'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+    return row[0] if row else None
+
+
+def get_etl_stages(conn):
+
+    # the per-stage timings of the last etl run, as saved by etl.save_stage_timings
+    try:
+        row = conn.execute("select value from etl_metadata where key = 'etl_stages'").fetchone()
+    except sqlite3.OperationalError:
+        return {}
+
+    return json.loads(row[0]) if row else {}
+
+
+def set_db_version(cursor):
+
+    # stamps the db with a new, unique version; anything cached against the previous version is now out of date
+    version = uuid.uuid4().hex
+    cursor.execute("insert or replace into etl_metadata (key, value) values ('db_version', ?)", [version])
+
+    return version
+
+
+def materialized_table(view_name):
+
+    return "{}_materialized".format(view_name)
+
+
+def report_query(view_name, materialized=False):
+
+    # materialized tables are filled in the view's order, so reading them back in rowid order reproduces the view
+    if materialized:
+        return "select * from {} order by rowid".format(materialized_table(view_name))
+
+    return "select * from {}".format(view_name)
+
+
+def keyset_query(view_name, materialized=False):
+
+    # the keyset query that pages through a report, along with its sql
+    if materialized:
+        return MATERIALIZED_KEYSET_QUERY, MATERIALIZED_KEYSET_QUERY["sql"].format(table=materialized_table(view_name))
+
+    return KEYSET_QUERIES[view_name], KEYSET_QUERIES[view_name]["sql"]
+
+
+def fetch_report_page(conn, view_name, after=None, page_size=100, materialized=False):
+
+    # fetches the page of a report that follows the key `after` (or the first page, if None). returns the report's
+    # column names, the page's rows, and the key to fetch the next page with (None on the last page)
+    keyset, sql = keyset_query(view_name, materialized)
+    num_keys = len(keyset["start"])
+
+    if after is not None and len(after) != num_keys:
+        raise ValueError("a {} page key has {} values, not {}".format(view_name, num_keys, len(after)))
+
+    params = {"k{}".format(i + 1): key for i, key in enumerate(after or keyset["start"])}
+    params["limit"] = page_size + 1
+
+    cursor = conn.execute(sql, params)
+    columns = [col[0] for col in cursor.description[num_keys:]]
+    rows = cursor.fetchall()
+
+    next_after = list(rows[page_size - 1][:num_keys]) if len(rows) > page_size else None
+
+    return columns, [row[num_keys:] for row in rows[:page_size]], next_after
+
+
+def refresh_report_tables(cursor, materialize=True):
+
+    # (re)creates a table holding a snapshot of each report view. this must be run whenever the etl changes the data the
+    # views are built on; with materialize=False, any existing snapshots are dropped, so that they can't go stale
+    for view_name in REPORT_VIEWS:
+
+        cursor.execute("drop table if exists {}".format(materialized_table(view_name)))
+
+        if materialize:
+            cursor.execute("create table {} as {}".format(materialized_table(view_name), report_query(view_name)))
+
+
+def report_tables_match(cursor, materialize=True):
+
+    # whether the db already has a snapshot of every report view (with materialize=True), or of none of them (with
+    # materialize=False), ie whether refresh_report_tables would only need to run if the data had changed
+    num_tables = cursor.execute("select count(*) from sqlite_master where type = 'table' and name in ({})".format(
+        ", ".join("?" for _ in REPORT_VIEWS)), [materialized_table(view_name) for view_name in REPORT_VIEWS]).fetchone()[0]
+
+    return num_tables == (len(REPORT_VIEWS) if materialize else 0)
+
+
+def verify_report_tables(conn):
+
+    # returns the names of the views whose materialized table doesn't match the view row for row
+    mismatched = []
+
+    for view_name in REPORT_VIEWS:
+
+        view_rows = conn.execute(report_query(view_name))
+        table_rows = conn.execute(report_query(view_name, materialized=True))
+
+        if [col[0] for col in view_rows.description] != [col[0] for col in table_rows.description] or \
+                any(a != b for a, b in zip_longest(view_rows, table_rows)):
+            mismatched.append(view_name)
+
+    return mismatched
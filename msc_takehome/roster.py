@@ -0,0 +1,202 @@
+from array import array
+from threading import Lock
+from msc_takehome.reports import get_db_version
+import sys
+
+
+class Musician(object):
+
+    __slots__ = ("id", "first_name", "middle_name", "last_name")
+
+    def __init__(self, id, first_name, middle_name, last_name):
+
+        self.id = id
+        self.first_name = first_name
+        self.middle_name = middle_name
+        self.last_name = last_name
+
+
+class Instrument(object):
+
+    __slots__ = ("id", "instrument", "section")
+
+    def __init__(self, id, instrument, section):
+
+        self.id = id
+        self.instrument = instrument
+        self.section = section
+
+
+def intern(value):
+
+    # names and sections repeat a lot across the roster, so each distinct string is only kept once
+    return sys.intern(value) if value is not None else None
+
+
+class RosterIndex(object):
+    """
+    An in-memory copy of the roster (names, instruments, and the assignments between them) for one version of the db,
+    with each musician's instruments and each instrument's players looked up ahead of time, so that the reports can be
+    put together without going back to sqlite. each report comes out exactly as its view in create_schema_sqlite.sql
+    """
+
+    columns = {
+        "all_musicians": ["first_name", "middle_name", "last_name", "instrument", "section"],
+        "instruments_without_musicians": ["instrument", "section"],
+        "multi_instrumentalists": ["first_name", "middle_name", "last_name", "instrument", "section"],
+        "multiple_players": ["instrument", "section", "first_name", "middle_name", "last_name"]
+    }
+
+    def __init__(self, version, names, instruments, assignments):
+
+        self.version = version
+
+        # musicians and instruments in id order, which is the order the views sort them in
+        self.musicians = {row[0]: Musician(row[0], *map(intern, row[1:])) for row in sorted(names)}
+        self.instruments = {row[0]: Instrument(row[0], *map(intern, row[1:])) for row in sorted(instruments)}
+
+        # the assignments as a pair of id columns, and each side's ids grouped by the other side's (both sorted by id).
+        # assignments are kept as they are, duplicates included, since the views count assignments rather than
+        # distinct instruments / players
+        self.player_ids = array("q")
+        self.instrument_ids = array("q")
+
+        for player_id, instrument_id in assignments:
+            self.player_ids.append(player_id)
+            self.instrument_ids.append(instrument_id)
+
+        self.player_instruments = {}
+        self.instrument_players = {}
+
+        for player_id, instrument_id in sorted(zip(self.player_ids, self.instrument_ids)):
+            self.player_instruments.setdefault(player_id, array("q")).append(instrument_id)
+
+        for instrument_id, player_id in sorted(zip(self.instrument_ids, self.player_ids)):
+            self.instrument_players.setdefault(instrument_id, array("q")).append(player_id)
+
+        self._reports = {}
+        self._lock = Lock()
+
+
+    @classmethod
+    def load(cls, conn):
+
+        # everything is read in one transaction, so that it all comes from the same version of the db
+        conn.execute("BEGIN")
+
+        try:
+            return cls(get_db_version(conn),
+                       conn.execute("select id, first_name, middle_name, last_name from names").fetchall(),
+                       conn.execute("select id, instrument, section from instruments").fetchall(),
+                       conn.execute("select player_id, instrument_id from assignments").fetchall())
+        finally:
+            conn.execute("ROLLBACK")
+
+
+    def report(self, view_name):
+
+        # the report's columns and rows. reports are only put together once, the first time they're asked for
+        with self._lock:
+
+            if view_name not in self._reports:
+                self._reports[view_name] = getattr(self, view_name)()
+
+            return self.columns[view_name], self._reports[view_name]
+
+
+    def all_musicians(self):
+
+        rows = []
+
+        for musician in self.musicians.values():
+
+            name = (musician.first_name, musician.middle_name, musician.last_name)
+            instrument_ids = self.player_instruments.get(musician.id)
+
+            if not instrument_ids:
+                rows.append(name + (None, None))
+                continue
+
+            # an assignment to a missing instrument is left joined to nulls, which sort ahead of any instrument id
+            for instrument_id in sorted(instrument_ids, key=lambda i: (i in self.instruments, i)):
+
+                instrument = self.instruments.get(instrument_id)
+
+                if instrument is None:
+                    rows.append(name + (None, None))
+                else:
+                    rows.append(name + (instrument.instrument, instrument.section))
+
+        return rows
+
+
+    def instruments_without_musicians(self):
+
+        instruments = [instrument for instrument in self.instruments.values() if instrument.id not in self.instrument_players]
+
+        return [(instrument.instrument, instrument.section) for instrument in sorted(instruments, key=lambda i: i.section)]
+
+
+    def multi_instrumentalists(self):
+
+        rows = []
+
+        for musician in self.musicians.values():
+
+            instrument_ids = self.player_instruments.get(musician.id, ())
+
+            if len(instrument_ids) < 2:
+                continue
+
+            for instrument_id in instrument_ids:
+
+                instrument = self.instruments.get(instrument_id)
+
+                if instrument is not None:
+                    rows.append((musician.first_name, musician.middle_name, musician.last_name,
+                                 instrument.instrument, instrument.section))
+
+        return rows
+
+
+    def multiple_players(self):
+
+        rows = []
+
+        for instrument in self.instruments.values():
+
+            player_ids = self.instrument_players.get(instrument.id, ())
+
+            if len(player_ids) < 2:
+                continue
+
+            for player_id in player_ids:
+
+                musician = self.musicians.get(player_id)
+
+                if musician is not None:
+                    rows.append((instrument.instrument, instrument.section,
+                                 musician.first_name, musician.middle_name, musician.last_name))
+
+        return rows
+
+
+# the roster index for the most recently seen db version
+roster_lock = Lock()
+current_roster = None
+
+
+def get_roster(conn):
+
+    # the roster index for the db's current version, reloaded whenever the etl has changed the db. a db without a version
+    # stamp can't be told apart from a changed one, so its roster is loaded every time
+    global current_roster
+
+    version = get_db_version(conn)
+
+    with roster_lock:
+
+        if version is None or current_roster is None or current_roster.version != version:
+            current_roster = RosterIndex.load(conn)
+
+        return current_roster
@@ -1,49 +1,121 @@
-from flask import Flask, render_template, g
-import pandas as pd
-import sqlite3
+from flask import Flask, Response, render_template, make_response, request, abort, url_for, stream_with_context, jsonify, g
+from msc_takehome.cache import ReportCache
+from msc_takehome.export import EXPORT_FORMATS, project, gzip_chunks
+import msc_takehome.export as export_formats
+from msc_takehome.metrics import Histogram, expose_gauge
+from msc_takehome.pool import ConnectionPool, PoolTimeout
+from msc_takehome.render import html_table, cursor_batches, row_batches
+from msc_takehome.roster import get_roster
+from msc_takehome.search import SEARCHES, search
+from msc_takehome.shards import shard_report, shard_rows, merge_reports, merge_rows, combined_version
+from msc_takehome.reports import report_query, keyset_query, fetch_report_page, get_db_version, get_etl_stages
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import base64
+import json
 
 
 app = Flask(__name__)
-app.config.from_object("config.Config")
+app.config.from_object("msc_takehome.config.Config")
 
+report_cache = ReportCache(app.config.get("REPORT_CACHE_SIZE"))
 
-def get_db(db_file):
+# how long report requests take, broken down by view and by phase: running the query, rendering the page, and the
+# request as a whole (streamed reports query and render at the same time, so they're timed as a single "stream" phase)
+report_latency = Histogram("orchestra_report_seconds", "Time spent serving /report/<view_name>", ["view", "phase"])
 
-    db = getattr(g, "_database", None)
+# reads each ensemble's shard in parallel, when reports are merged across ensembles
+shard_executor = ThreadPoolExecutor(max_workers=app.config.get("SHARD_THREADS"), thread_name_prefix="shard")
 
-    if db is None:
-        conn = g._database = sqlite3.connect(db_file)
+# one connection pool per db file
+pools = {}
+pools_lock = threading.Lock()
 
-    return conn
+# the integers sqlite can bind as query parameters, any others overflow
+SQLITE_INTEGERS = range(-2 ** 63, 2 ** 63)
 
+# stands in for the report table when rendering the page around it, so that the table can be streamed into the middle
+CONTENT_MARKER = "<!-- report content -->"
 
-def process_report_df(df):
 
-    # re-upper case strings
-    for column in df:
+def get_pool(db_file):
 
-        if df[column].dtype == "object":
-            df[column] = df[column].str.title()
+    with pools_lock:
 
-    # convert `None` to empty string
-    df = df.fillna(value="")
+        if db_file not in pools:
+            pools[db_file] = ConnectionPool(db_file,
+                                            cache_size_kb=app.config.get("DB_CACHE_SIZE_KB"),
+                                            mmap_size=app.config.get("DB_MMAP_SIZE"),
+                                            max_size=app.config.get("DB_POOL_SIZE"),
+                                            timeout=app.config.get("DB_POOL_TIMEOUT"))
 
-    # convert database col names to human friendly
-    df = df.rename(
-        mapper=lambda col: col.replace("_", " ").title(),
-        axis="columns"
-    )
+        return pools[db_file]
+
+
+def get_db(db_file):
+
+    # connections are pooled, and reused across requests, rather than opened and closed for every request. a request
+    # borrows at most one connection per db file, which goes back to the pool when the request (or the streamed response
+    # it returned) is done with it; see return_db
+    if "connections" not in g:
+        g.connections = {}
+
+    if db_file not in g.connections:
+
+        pool = get_pool(db_file)
+
+        try:
+            g.connections[db_file] = (pool, pool.acquire())
+        except PoolTimeout:
+            abort(503)
 
-    return df
+    return g.connections[db_file][1]
 
 
 @app.teardown_appcontext
-def close_connection(exception):
+def return_db(exception):
+
+    for pool, conn in g.pop("connections", {}).values():
+        pool.release(conn)
+
+
+def encode_page_key(key):
+
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def is_bindable(value):
+
+    # bools are ints to python, but json's true / false aren't keyset values, so they're rejected along with the rest
+    if isinstance(value, bool):
+        return False
+
+    if isinstance(value, int):
+        return value in SQLITE_INTEGERS
+
+    return value is None or isinstance(value, (str, float))
 
-    db = getattr(g, "_database", None)
 
-    if db is not None:
-        db.close()
+def decode_page_key(token, length):
+
+    # page keys come from the client, so anything other than a list of `length` values that sqlite can bind is rejected
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        abort(400)
+
+    if not isinstance(key, list) or len(key) != length or not all(is_bindable(value) for value in key):
+        abort(400)
+
+    return key
+
+
+def get_report_name(view_name):
+
+    for x in app.config.get("REPORTS"):
+        if x["view"] == view_name:
+            return x["name"]
 
     return None
 
@@ -54,16 +126,329 @@ def index():
     return render_template("index.html", reports=app.config.get("REPORTS"))
 
 
+def log_slow_query(conn, query, params, seconds):
+
+    # logs queries that took longer than SLOW_QUERY_SECONDS, along with their query plan
+    threshold = app.config.get("SLOW_QUERY_SECONDS")
+
+    if threshold is None or seconds < threshold:
+        return
+
+    plan = "\n".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params))
+    app.logger.warning("slow query (%.3fs): %s\n%s", seconds, " ".join(query.split()), plan)
+
+
+def render_report(conn, view_name):
+
+    start = time.perf_counter()
+
+    if app.config.get("ROSTER_INDEX"):
+        columns, rows = get_roster(conn).report(view_name)
+        report_latency.observe(time.perf_counter() - start, view=view_name, phase="query")
+
+    else:
+        query = report_query(view_name, materialized=app.config.get("MATERIALIZE_REPORTS"))
+
+        cursor = conn.execute(query)
+        columns = [col[0] for col in cursor.description]
+        rows = cursor.fetchall()
+        query_seconds = time.perf_counter() - start
+
+        report_latency.observe(query_seconds, view=view_name, phase="query")
+        log_slow_query(conn, query, [], query_seconds)
+
+    return render_rows(view_name, columns, rows)
+
+
+def render_sharded_report(conns, view_name):
+
+    # the report from every ensemble's shard, each read on its own thread (with the connection the request borrowed for
+    # that shard), merged into one
+    start = time.perf_counter()
+
+    ensembles = list(conns)
+    shard_reports = shard_executor.map(lambda ensemble: shard_report(conns[ensemble], view_name), ensembles)
+    columns, rows = merge_reports(dict(zip(ensembles, shard_reports)))
+
+    report_latency.observe(time.perf_counter() - start, view=view_name, phase="query")
+
+    return render_rows(view_name, columns, rows)
+
+
+def render_rows(view_name, columns, rows):
+
+    start = time.perf_counter()
+    content = render_template(
+        "report.html",
+        content="".join(html_table(columns, [rows])),
+        name=get_report_name(view_name)
+    )
+    report_latency.observe(time.perf_counter() - start, view=view_name, phase="render")
+
+    return content
+
+
+def render_report_page(conn, view_name):
+
+    # a single page of the report, with a link to the page that follows it
+    page_size = request.args.get("page_size", type=int)
+
+    if page_size is None or page_size < 1:
+        abort(400)
+
+    after = request.args.get("after")
+    materialized = app.config.get("MATERIALIZE_REPORTS")
+
+    if after:
+        keyset, _ = keyset_query(view_name, materialized)
+        after = decode_page_key(after, len(keyset["start"]))
+
+    start = time.perf_counter()
+
+    columns, rows, next_after = fetch_report_page(conn,
+                                                  view_name,
+                                                  after=after or None,
+                                                  page_size=min(page_size, app.config.get("REPORT_MAX_PAGE_SIZE")),
+                                                  materialized=materialized)
+
+    report_latency.observe(time.perf_counter() - start, view=view_name, phase="query")
+    start = time.perf_counter()
+
+    if next_after is not None:
+        next_url = url_for("report", view_name=view_name, page_size=page_size, after=encode_page_key(next_after))
+    else:
+        next_url = None
+
+    content = render_template(
+        "report.html",
+        content="".join(html_table(columns, [rows])),
+        name=get_report_name(view_name),
+        next_url=next_url
+    )
+    report_latency.observe(time.perf_counter() - start, view=view_name, phase="render")
+
+    return content
+
+
+def stream_report(conn, view_name):
+
+    # sends the page out piece by piece: everything up to the report table, then the table a batch of rows at a time as
+    # they're read off the cursor, and then the rest of the page
+    head, foot = render_template("report.html", content=CONTENT_MARKER, name=get_report_name(view_name)).split(CONTENT_MARKER)
+
+    cursor = conn.execute(report_query(view_name, materialized=app.config.get("MATERIALIZE_REPORTS")))
+    columns = [col[0] for col in cursor.description]
+
+    def generate():
+
+        start = time.perf_counter()
+
+        yield head
+        yield from html_table(columns, cursor_batches(cursor))
+        yield foot
+
+        report_latency.observe(time.perf_counter() - start, view=view_name, phase="stream")
+
+    return Response(stream_with_context(generate()), mimetype="text/html")
+
+
+def cached_report(view_name, version, render):
+
+    # the rendered report, from the cache if this version of it has been rendered before
+    content = report_cache.get((view_name, version))
+
+    if content is None:
+        content = render()
+        report_cache.put((view_name, version), content)
+
+    return content
+
+
 @app.route("/report/<view_name>")
 def report(view_name):
 
+    start = time.perf_counter()
+    response = serve_report(view_name)
+    report_latency.observe(time.perf_counter() - start, view=view_name, phase="total")
+
+    return response
+
+
+def serve_report(view_name):
+
+    if get_report_name(view_name) is None:
+        abort(404)
+
+    # with ensembles, the full report is merged from each ensemble's shard. paging and streaming aren't supported there,
+    # so asking for them is an error, rather than being quietly answered with the full report
+    if app.config.get("ENSEMBLES"):
+
+        if "page_size" in request.args or request.args.get("stream", type=int):
+            abort(501, description="reports merged across ensembles can't be paged or streamed")
+
+        return conditional_report(view_name, *report_source(view_name))
+
     conn = get_db(app.config.get("DB_FILE"))
-    query = "select * from {view_name}".format(view_name=view_name)
-    df = process_report_df(pd.read_sql(query, conn))
-    name = list(filter(lambda x: x["view"] == view_name, app.config.get("REPORTS")))[0]["name"]
 
-    return render_template(
-        "report.html",
-        content=df.to_html(index=False),
-        name=name
-    )
+    if "page_size" in request.args:
+        return render_report_page(conn, view_name)
+
+    if request.args.get("stream", default=int(app.config.get("STREAM_REPORTS")), type=int):
+        return stream_report(conn, view_name)
+
+    return conditional_report(view_name, *report_source(view_name))
+
+
+def shard_dbs():
+
+    # a connection to each ensemble's shard, by ensemble
+    return {ensemble: get_db(shard["db_file"]) for ensemble, shard in app.config.get("ENSEMBLES").items()}
+
+
+def report_source(view_name):
+
+    # the version of the full report, and a fn that renders it: from the db, or merged from every ensemble's shard
+    if app.config.get("ENSEMBLES"):
+        conns = shard_dbs()
+        version = combined_version([get_db_version(conns[ensemble]) for ensemble in sorted(conns)])
+
+        return version, lambda: render_sharded_report(conns, view_name)
+
+    conn = get_db(app.config.get("DB_FILE"))
+
+    return get_db_version(conn), lambda: render_report(conn, view_name)
+
+
+def conditional_report(view_name, version, render):
+
+    # reports only change when the etl runs, so a rendered report can be reused for as long as the db version stays the
+    # same. a db without a version stamp can't be cached
+    if version is None:
+        return render()
+
+    etag = "{}-{}".format(version, view_name)
+
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    response = make_response(cached_report(view_name, version, render))
+    response.set_etag(etag)
+
+    return response.make_conditional(request)
+
+
+@app.route("/export/<view_name>.<export_format>")
+def export(view_name, export_format):
+
+    # a report as csv, ndjson, or an arrow ipc stream, for downstream jobs. rows are streamed straight off the cursor a
+    # batch at a time, so that the whole report never needs to be held in memory. ?columns=a,b picks out just those
+    # columns, and the response is gzipped for clients that accept it
+    if get_report_name(view_name) is None or export_format not in EXPORT_FORMATS:
+        abort(404)
+
+    if export_format == "arrow" and export_formats.pa is None:
+        abort(501, description="arrow export needs pyarrow to be installed")
+
+    mimetype, encoder = EXPORT_FORMATS[export_format]
+
+    # with ensembles, the rows are merged from each ensemble's shard as they're read
+    if app.config.get("ENSEMBLES"):
+        conns = shard_dbs()
+        columns, rows = merge_rows({ensemble: shard_rows(conn, view_name) for ensemble, conn in conns.items()})
+        batches = row_batches(rows, app.config.get("EXPORT_BATCH_SIZE"))
+
+    else:
+        conn = get_db(app.config.get("DB_FILE"))
+        cursor = conn.execute(report_query(view_name, materialized=app.config.get("MATERIALIZE_REPORTS")))
+        columns = [col[0] for col in cursor.description]
+        batches = cursor_batches(cursor, app.config.get("EXPORT_BATCH_SIZE"))
+
+    if "columns" in request.args:
+        try:
+            columns, batches = project(columns, batches, request.args["columns"].split(","))
+        except ValueError as e:
+            abort(400, description=str(e))
+
+    chunks = encoder(columns, batches)
+    gzipped = bool(request.accept_encodings["gzip"])
+
+    if gzipped:
+        chunks = gzip_chunks(chunks, app.config.get("EXPORT_GZIP_LEVEL"))
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+
+    if gzipped:
+        response.content_encoding = "gzip"
+
+    response.vary.add("Accept-Encoding")
+    response.headers["Content-Disposition"] = "attachment; filename={}.{}".format(view_name, export_format)
+
+    return response
+
+
+@app.route("/search")
+def search_roster():
+
+    # musicians and instruments matching ?q, best match first, as json. every word in q is matched as a prefix, for
+    # autocomplete. ?type limits the results to just musicians or instruments, and ?page / ?page_size page through them
+    text = request.args.get("q")
+    kinds = request.args.getlist("type") or list(SEARCHES)
+    page = request.args.get("page", default=1, type=int)
+    page_size = request.args.get("page_size", default=20, type=int)
+
+    if text is None or page < 1 or page_size < 1 or any(kind not in SEARCHES for kind in kinds):
+        abort(400)
+
+    # each shard has its own search indexes, and bm25 scores from different indexes can't be compared, so there's no
+    # way to rank the matches from every ensemble against each other
+    if app.config.get("ENSEMBLES"):
+        abort(501, description="search isn't supported across ensembles")
+
+    page_size = min(page_size, app.config.get("SEARCH_MAX_PAGE_SIZE"))
+
+    # a page so far in that sqlite can't bind its offset can't have any matches on it either, but it's still a bad request
+    if (page - 1) * page_size not in SQLITE_INTEGERS:
+        abort(400)
+
+    conn = get_db(app.config.get("DB_FILE"))
+
+    results = {"query": text, "page": page, "page_size": page_size, "next_page": None}
+
+    for kind in kinds:
+
+        results[kind], more = search(conn, text, kind, page=page, page_size=page_size)
+
+        if more:
+            results["next_page"] = page + 1
+
+    return jsonify(results)
+
+
+@app.route("/metrics")
+def metrics():
+
+    # prometheus text exposition of the report latencies, the report cache, and the stage timings of the last etl run
+    lines = report_latency.expose()
+    lines += expose_gauge("orchestra_report_cache_hits_total", "Reports served from the report cache",
+                          [([], report_cache.hits)], metric_type="counter")
+    lines += expose_gauge("orchestra_report_cache_misses_total", "Reports that had to be rendered",
+                          [([], report_cache.misses)], metric_type="counter")
+
+    # with ensembles, each shard's last etl run is labelled with its ensemble
+    if app.config.get("ENSEMBLES"):
+        stages = [([("ensemble", ensemble), ("stage", stage)], totals)
+                  for ensemble, conn in sorted(shard_dbs().items())
+                  for stage, totals in sorted(get_etl_stages(conn).items())]
+    else:
+        stages = [([("stage", stage)], totals) for stage, totals in sorted(get_etl_stages(get_db(app.config.get("DB_FILE"))).items())]
+
+    lines += expose_gauge("orchestra_etl_stage_seconds", "Time spent in each stage of the last etl run",
+                          [(labels, totals["seconds"]) for labels, totals in stages])
+    lines += expose_gauge("orchestra_etl_stage_rows", "Rows processed by each stage of the last etl run",
+                          [(labels, totals["rows"]) for labels, totals in stages])
+    lines += expose_gauge("orchestra_etl_stage_calls", "Number of times each stage of the last etl run was entered",
+                          [(labels, totals["calls"]) for labels, totals in stages])
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,82 @@
+import re
+
+
+# for each searchable table: its full text index (see create_schema_sqlite.sql), and the query that pages through the
+# rows matching a search, best match first. bm25 scores are negative, with lower scores being better matches
+SEARCHES = {
+    "musicians": {
+        "table": "names",
+        "index": "names_fts",
+        "sql": """
+            select n.id, n.first_name, n.middle_name, n.last_name
+              from names_fts f
+                   inner join names n
+                       on n.id = f.rowid
+             where names_fts match :query
+             order by bm25(names_fts), n.id
+             limit :limit offset :offset
+        """
+    },
+    "instruments": {
+        "table": "instruments",
+        "index": "instruments_fts",
+        "sql": """
+            select i.id, i.instrument, i.section
+              from instruments_fts f
+                   inner join instruments i
+                       on i.id = f.rowid
+             where instruments_fts match :query
+             order by bm25(instruments_fts), i.id
+             limit :limit offset :offset
+        """
+    }
+}
+
+
+def rebuild_search_index(cursor):
+
+    # the search indexes don't keep their own copy of the data, or follow changes to it, so a newly loaded db has them
+    # built from scratch from their tables
+    for search in SEARCHES.values():
+        cursor.execute("insert into {0}({0}) values ('rebuild')".format(search["index"]))
+
+
+def update_search_index(cursor, index, columns, removed, added):
+
+    # applies changes to an index's table to the index, row by row, rather than rebuilding it: removed rows are taken out
+    # with fts5's 'delete' command, which needs the values they were indexed with, and added rows are indexed. both are
+    # (id, *values) tuples of the index's columns. a row that was changed in place is removed with its old values and added
+    # with its new ones
+    placeholders = ", ".join("?" for _ in columns)
+
+    cursor.executemany(
+        "insert into {0}({0}, rowid, {1}) values ('delete', ?, {2})".format(index, ", ".join(columns), placeholders),
+        removed
+    )
+    cursor.executemany("insert into {}(rowid, {}) values (?, {})".format(index, ", ".join(columns), placeholders), added)
+
+
+def match_query(text):
+
+    # turns what was typed into the search box into an fts5 query that matches rows with a word starting with each of the
+    # words typed, so that partly typed words still match (eg "joh smi" finds "john smith"). anything other than letters
+    # and digits is dropped, so there's no fts5 syntax to escape
+    tokens = re.findall(r"\w+", text.lower())
+
+    return " ".join('"{}"*'.format(token) for token in tokens)
+
+
+def search(conn, text, kind, page=1, page_size=20):
+
+    # one page of the rows of the given kind ("musicians" or "instruments") matching a search, best match first, along
+    # with whether there's another page after it
+    query = match_query(text)
+
+    if not query:
+        return [], False
+
+    cursor = conn.execute(SEARCHES[kind]["sql"], {"query": query, "limit": page_size + 1, "offset": (page - 1) * page_size})
+    columns = [col[0] for col in cursor.description]
+    rows = cursor.fetchall()
+
+    return [dict(zip(columns, row)) for row in rows[:page_size]], len(rows) > page_size
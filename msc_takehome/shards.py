@@ -0,0 +1,64 @@
+from msc_takehome.reports import KEYSET_QUERIES
+import hashlib
+import heapq
+
+
+# with Config.ENSEMBLES, each ensemble's roster lives in its own db (shard), which is loaded (see etl.setup_ensembles)
+# and swapped in independently of the others. reports are put together by reading the report from every shard and
+# merging the rows in the order the view sorts them in
+
+
+def shard_rows(conn, view_name):
+
+    # the whole report from one shard, with each row paired with its sort key, read lazily off of the cursor. this is the
+    # view's keyset query (see reports.KEYSET_QUERIES) starting from the beginning and without a limit, so rows come out
+    # in key order
+    query = KEYSET_QUERIES[view_name]
+    key_length = len(query["start"])
+
+    params = {"k{}".format(i + 1): k for i, k in enumerate(query["start"])}
+    params["limit"] = -1
+
+    cursor = conn.execute(query["sql"], params)
+    columns = [col[0] for col in cursor.description][key_length:]
+
+    return columns, ((row[:key_length], row[key_length:]) for row in cursor)
+
+
+def shard_report(conn, view_name):
+
+    columns, rows = shard_rows(conn, view_name)
+
+    return columns, list(rows)
+
+
+def merge_rows(shard_reports):
+
+    # merges each ensemble's (columns, keyed rows) into a single report, sorted as the view is, with the ensemble each
+    # row came from as its first column. rows with the same key (eg the first musician of each ensemble) are ordered by
+    # ensemble. the merged rows are produced lazily, so shards read with shard_rows are streamed rather than held in memory
+    ensembles = sorted(shard_reports)
+    columns = ["ensemble"] + shard_reports[ensembles[0]][0]
+
+    def keyed(ensemble):
+        return ((key, ensemble, (ensemble,) + row) for key, row in shard_reports[ensemble][1])
+
+    merged = heapq.merge(*[keyed(ensemble) for ensemble in ensembles])
+
+    return columns, (row for _, _, row in merged)
+
+
+def merge_reports(shard_reports):
+
+    columns, rows = merge_rows(shard_reports)
+
+    return columns, list(rows)
+
+
+def combined_version(versions):
+
+    # a version for the merged reports, which changes whenever any shard's version does. None if any shard is unversioned
+    if not versions or None in versions:
+        return None
+
+    return hashlib.sha1("-".join(versions).encode()).hexdigest()
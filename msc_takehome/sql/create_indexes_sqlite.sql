@@ -0,0 +1,16 @@
+-- secondary indexes (and unique constraints) for the tables in create_schema_sqlite.sql. these are kept separate from
+-- the tables, so that a bulk load can build them once over all of the loaded data, rather than maintaining them row by row
+
+-- Q: should there be a unique index on instrument?
+-- A: probably not, but it would make sense to have a unique constraint on the combination of instrument/section
+-- ie, one instrument can exist in multiple different section designations, but that instrument should not be duplicated within its section
+create unique index instruments_instrument_section on instruments (instrument, section);
+
+-- lets the reports look up a musician's instruments / an instrument's musicians, and walk instruments in section order,
+-- without a scan and sort
+create index assignments_player_id on assignments (player_id, instrument_id);
+create index assignments_instrument_id on assignments (instrument_id, player_id);
+create index instruments_section on instruments (section);
+
+-- lets assignments be linked to musicians by name with an index lookup
+create index name_keys_nick_name_last_name on name_keys (nick_name, last_name, name_part, player_id);
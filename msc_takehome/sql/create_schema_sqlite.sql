@@ -5,14 +5,11 @@ create table names (
   last_name varchar(255)
 );
 
--- Q: should there be a unique index on instrument?
--- A: probably not, but it would make sense to have a unique constraint on the combination of instrument/section
--- ie, one instrument can exist in multiple different section designations, but that instrument should not be duplicated within its section
+-- NOTE: instruments are unique on instrument/section; see the unique index in create_indexes_sqlite.sql
 create table instruments (
   id integer primary key autoincrement,
   instrument varchar(255) not null,
-  section varchar(255) not null,
-  unique(instrument, section)
+  section varchar(255) not null
 );
 
 create table assignments_by_name(
@@ -31,6 +28,37 @@ create table assignments (
   foreign key (instrument_id) references instruments(id)
 );
 
+-- every key that a musician can be referred to by in name_instrument.csv: either their first or middle name (name_part 0
+-- or 1, respectively), along with their last name. this is derived from names during the etl, so that assignments can
+-- be linked to musicians with an index lookup rather than by comparing against every name
+create table name_keys (
+  id integer primary key autoincrement,
+  player_id integer not null,
+  name_part integer not null,
+  nick_name varchar(255) not null,
+  last_name varchar(255) not null,
+  foreign key (player_id) references names(id)
+);
+
+-- full text search over musicians and instruments, for /search. these are external content tables: they index names and
+-- instruments without keeping a copy of them. a full etl run builds them, and an incremental run updates the rows it
+-- changes. the prefix indexes make autocomplete-style queries on the first few letters of a word quick
+create virtual table names_fts using fts5(
+  first_name, middle_name, last_name,
+  content='names', content_rowid='id', prefix='2 3'
+);
+
+create virtual table instruments_fts using fts5(
+  instrument, section,
+  content='instruments', content_rowid='id', prefix='2 3'
+);
+
+-- bookkeeping written by the etl, eg the version stamp of the data that was last loaded
+create table etl_metadata (
+  key varchar(255) primary key,
+  value varchar(255) not null
+);
+
 -- REPORTS
 -- 1. A report showing the name, instrument, and section for all musicians.
 create view all_musicians as
@@ -52,41 +80,27 @@ create view instruments_without_musicians as
    order by section asc;
 
 -- 3. A report showing any musicians that play two or more instruments, their instrument, and section.
+-- (assignments are read in the order of the assignments_player_id index, which is the same as ordering by musician and
+-- then instrument, since both are inner joined on their ids. a musician plays two or more instruments if they have
+-- another assignment besides this one, which is also looked up in the same index)
 create view multi_instrumentalists as
-  with instrument_count as (
-    select player_id, instrument_id,
-           count(instrument_id) over (partition by player_id) as num_instruments
-      from assignments a
-  ),
-  multi_instrumentalists as (
-    select *
-      from instrument_count
-     where num_instruments > 1
-  )
   select n.first_name, n.middle_name , n.last_name , i.instrument , i.section
-    from names n
-         inner join multi_instrumentalists m
-             on n.id = m.player_id
+    from assignments a
+         inner join names n
+             on n.id = a.player_id
          inner join instruments i
-             on i.id = m.instrument_id
-   order by n.id, i.id asc;
+             on i.id = a.instrument_id
+   where exists (select 1 from assignments c where c.player_id = a.player_id and c.id != a.id)
+   order by a.player_id, a.instrument_id asc;
 
 -- 4. A report showing any instruments that are played by multiple musicians, as well as the musician names and sections.
+-- (as with multi_instrumentalists, but by instrument, using the assignments_instrument_id index)
 create view multiple_players as
-  with player_count as (
-	  select player_id, instrument_id,
-	         count(player_id) over (partition by instrument_id) as num_players
-	    from assignments a
-	),
-	multiple_players as (
-	  select *
-	    from player_count
-	   where num_players > 1
-	)
-	select i.instrument , i.section, n.first_name, n.middle_name , n.last_name
-	  from names n
-	       inner join multiple_players m
-	           on n.id = m.player_id
-	       inner join instruments i
-	           on i.id = m.instrument_id
-   order by i.id, n.id asc;
+  select i.instrument , i.section, n.first_name, n.middle_name , n.last_name
+    from assignments a
+         inner join instruments i
+             on i.id = a.instrument_id
+         inner join names n
+             on n.id = a.player_id
+   where exists (select 1 from assignments c where c.instrument_id = a.instrument_id and c.id != a.id)
+   order by a.instrument_id, a.player_id asc;
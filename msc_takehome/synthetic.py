@@ -0,0 +1,90 @@
+import random
+import os
+
+
+SYLLABLES = ["ba", "be", "bo", "da", "de", "do", "fa", "fi", "ga", "go", "ka", "ki", "la", "le", "lo", "ma", "mi", "mo",
+             "na", "ne", "no", "pa", "pi", "ra", "re", "ro", "sa", "si", "ta", "te", "to", "va", "vi", "za", "zo"]
+
+SECTIONS = ["Strings", "Woodwinds", "Brass", "Percussion", "Keyboards", "Other"]
+
+INSTRUMENTS = ["Violin", "Viola", "Cello", "Bass", "Flute", "Oboe", "Clarinet", "Bassoon", "Saxophone", "Trumpet",
+               "Trombone", "Tuba", "French Horn", "Piano", "Banjo", "Accordian", "Singer", "Whistle", "Harmonica"]
+
+# every name style that etl.expand_name_fn handles, along with how name_instrument.csv refers to a musician named that
+# way (musicians whose first name is only an initial are referred to by their middle name)
+NAME_STYLES = [
+    ("{first} {last}", "{first} {last}"),
+    ("{first} {middle} {last}", "{first} {last}"),
+    ("{first}", "{first}"),
+    ("{last}, {first}", "{first} {last}"),
+    ("{last}, {first} {middle}", "{first} {last}"),
+    ("{last}, {initial}. {middle}", "{middle} {last}"),
+    ("{last}, {first} {initial}.", "{first} {last}")
+]
+
+
+def word(n):
+
+    # a unique, pronounceable word for every n >= 0
+    syllables = []
+
+    while True:
+        n, i = divmod(n, len(SYLLABLES))
+        syllables.append(SYLLABLES[i])
+
+        if n == 0:
+            return "".join(syllables).title()
+
+        n -= 1
+
+
+def musician(i, num_names):
+
+    # the i-th musician's name, as it's written in names.txt and as it's referred to in name_instrument.csv
+    name_style, reference_style = NAME_STYLES[i % len(NAME_STYLES)]
+    parts = {
+        "first": word(i),
+        "middle": word(num_names + i),
+        "last": word(2 * num_names + i),
+        "initial": word(i)[0]
+    }
+
+    return name_style.format(**parts), reference_style.format(**parts)
+
+
+def instrument(i):
+
+    # the named instruments (and their sections) first, followed by as many numbered variations as are needed
+    name = INSTRUMENTS[i % len(INSTRUMENTS)]
+
+    if i >= len(INSTRUMENTS):
+        name = "{} {}".format(name, word(i // len(INSTRUMENTS)))
+
+    return name, SECTIONS[i % len(SECTIONS)]
+
+
+def write_roster(data_dir, num_names, num_instruments=None, num_assignments=None, seed=0):
+
+    # writes a synthetic names.txt, instruments.csv, and name_instrument.csv to data_dir. by default there are roughly
+    # as many assignments as names, and enough instruments that most (but not all) of them are played by somebody
+    num_instruments = num_instruments or max(len(INSTRUMENTS), num_names // 20)
+    num_assignments = num_names if num_assignments is None else num_assignments
+    rng = random.Random(seed)
+
+    with open(os.path.join(data_dir, "instruments.csv"), "w") as f:
+        f.write("Instrument,Section\n")
+
+        for i in range(num_instruments):
+            f.write("{},{}\n".format(*instrument(i)))
+
+    with open(os.path.join(data_dir, "names.txt"), "w") as f:
+        for i in range(num_names):
+            f.write(musician(i, num_names)[0] + "\n")
+
+    with open(os.path.join(data_dir, "name_instrument.csv"), "w") as f:
+        f.write("Instrument,Name\n")
+
+        for _ in range(num_assignments):
+            # leave the last few instruments without anyone to play them
+            instrument_name, _ = instrument(rng.randrange(max(1, num_instruments - 3)))
+            f.write("{},{}\n".format(instrument_name, musician(rng.randrange(num_names), num_names)[1]))
@@ -1,10 +1,27 @@
 import unittest
 import msc_takehome.etl as etl
+import msc_takehome.reports as reports
+import msc_takehome.synthetic as synthetic
+import msc_takehome.plans as plans
+import msc_takehome.search as search
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from importlib import resources
 import pandas as pd
 import sqlite3
+import tempfile
 import os
 
 
+TABLES = ["names", "instruments", "assignments_by_name", "assignments"]
+
+
+def dump_tables(db_file, tables=TABLES):
+
+    with closing(sqlite3.connect(db_file)) as conn:
+        return {table: conn.execute("select * from {} order by id".format(table)).fetchall() for table in tables}
+
+
 class TestExpandNameFn(unittest.TestCase):
     """
     Tests the etl.expand_name_fn against the following name cases:
@@ -166,6 +183,92 @@ class TestExpandNameFn(unittest.TestCase):
         self.assertEqual(t, expected_last_first_m)
 
 
+class TestExpandNames(unittest.TestCase):
+    """
+    Tests that the vectorized etl.expand_names produces the same output as etl.expand_name_fn, for every name style that
+    TestExpandNameFn covers, as well as for a name that doesn't match any of them
+    """
+
+    names = [
+        "Pepe LePew",
+        "Daffy Sheldon Duck",
+        "Bender",
+        "Simpson, Lisa",
+        "Burns, Charles Montgomery",
+        "Skinner, W. Seymour",
+        "Simpson, Homer J.",
+        "Not, A Valid Name Style"
+    ]
+
+
+    def test_matches_expand_name_fn(self):
+
+        df = pd.DataFrame({"Name": self.names, "first_name": None, "middle_name": None, "last_name": None})
+        expected = df.apply(etl.expand_name_fn, axis=1, name_col="Name")[["first_name", "middle_name", "last_name"]]
+
+        t = etl.expand_names(df["Name"])
+
+        self.assertEqual(t.to_dict("records"), expected.to_dict("records"))
+
+
+    def test_expected_names(self):
+
+        t = etl.expand_names(pd.Series(self.names))
+
+        expected = [
+            {"first_name": "Pepe", "middle_name": None, "last_name": "LePew"},
+            {"first_name": "Daffy", "middle_name": "Sheldon", "last_name": "Duck"},
+            {"first_name": "Bender", "middle_name": None, "last_name": None},
+            {"first_name": "Lisa", "middle_name": None, "last_name": "Simpson"},
+            {"first_name": "Charles", "middle_name": "Montgomery", "last_name": "Burns"},
+            {"first_name": "W.", "middle_name": "Seymour", "last_name": "Skinner"},
+            {"first_name": "Homer", "middle_name": "J.", "last_name": "Simpson"},
+            {"first_name": None, "middle_name": None, "last_name": None}
+        ]
+
+        self.assertEqual(t.to_dict("records"), expected)
+
+
+class TestLowerColumn(unittest.TestCase):
+    """
+    Tests that etl.lower_column lowercases a column as str.lower would, dictionary encoding columns with few distinct
+    values, and that names are split the same way from an encoded column
+    """
+
+    def test_low_cardinality(self):
+
+        values = pd.Series(["Strings", "STRINGS", "Brass", None, "strings", "Brass"] * 10, name="Section")
+        lowered = etl.lower_column(values)
+
+        self.assertEqual(lowered.dtype, "category")
+        self.assertEqual(list(lowered.cat.categories), ["strings", "brass"])
+        self.assertEqual(lowered.name, "Section")
+        self.assertTrue(lowered.astype(object).where(lowered.notna(), None).equals(values.str.lower().where(values.notna(), None)))
+
+
+    def test_high_cardinality(self):
+
+        values = pd.Series(["Pepe LePew", "Bender", "Simpson, Lisa"])
+        lowered = etl.lower_column(values)
+
+        self.assertEqual(lowered.dtype, object)
+        self.assertEqual(list(lowered), ["pepe lepew", "bender", "simpson, lisa"])
+
+
+    def test_no_values(self):
+
+        for values in [pd.Series([None, None], dtype=object), pd.Series([], dtype=object)]:
+            self.assertEqual(list(etl.lower_column(values)), list(values))
+
+
+    def test_expand_names(self):
+
+        names = pd.Series(["Pepe LePew", "Simpson, Homer J.", "Pepe LePew", "Simpson, Homer J.", "Bender"] * 3)
+
+        self.assertEqual(etl.expand_names(etl.lower_column(names)).to_dict("records"),
+                         etl.expand_names(names.str.lower()).to_dict("records"))
+
+
 class ReportsIntegrationTest(unittest.TestCase):
 
     @classmethod
@@ -301,6 +404,595 @@ class ReportsIntegrationTest(unittest.TestCase):
         self.assertEqual(report, expected_report)
 
 
+class StreamingEtlTest(unittest.TestCase):
+    """
+    Tests that loading the input files in small chunks produces exactly the same database as loading them in one go
+    """
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+
+    def tearDown(self):
+
+        self.tmp_dir.cleanup()
+
+
+    def test_chunked_matches_full_load(self):
+
+        full_db = os.path.join(self.tmp_dir.name, "full.db")
+        chunked_db = os.path.join(self.tmp_dir.name, "chunked.db")
+
+        etl.db_setup(full_db)
+        etl.db_setup(chunked_db, chunk_size=3)
+
+        self.assertEqual(dump_tables(chunked_db), dump_tables(full_db))
+
+
+class DataDirTestCase(unittest.TestCase):
+    """
+    Base class for tests that need to modify the input files: copies the bundled input files into a temporary data dir,
+    and runs the etl from there
+    """
+
+    input_files = ["names.txt", "instruments.csv", "name_instrument.csv"]
+
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = os.path.join(self.tmp_dir.name, "data")
+        self.db_file = os.path.join(self.tmp_dir.name, "orchestra.db")
+
+        os.mkdir(self.data_dir)
+
+        for file_name in self.input_files:
+            self._write_input(file_name, resources.read_text("msc_takehome.data", file_name))
+
+
+    def tearDown(self):
+
+        self.tmp_dir.cleanup()
+
+
+    def _read_input(self, file_name):
+
+        with open(os.path.join(self.data_dir, file_name)) as f:
+            return f.read()
+
+
+    def _write_input(self, file_name, content):
+
+        with open(os.path.join(self.data_dir, file_name), "w") as f:
+            f.write(content)
+
+
+class LinkAssignmentsTest(DataDirTestCase):
+    """
+    Tests that assignments which can't be linked to a musician or instrument are reported
+    """
+
+    def test_unmatched_assignments(self):
+
+        self._write_input("name_instrument.csv",
+                          self._read_input("name_instrument.csv") + "Kazoo,Lisa Simpson\nTrumpet,Nelson Muntz\n")
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+
+            with self.assertLogs("msc_takehome.etl", level="WARNING"):
+                unmatched = etl.report_unmatched_assignments(conn.cursor())
+
+            num_assignments = conn.execute("select count(*) from assignments").fetchone()[0]
+
+        self.assertEqual(unmatched, [("kazoo", "lisa", None, "simpson"), ("trumpet", "nelson", None, "muntz")])
+        self.assertEqual(num_assignments, 19)
+
+
+class BulkLoadTest(unittest.TestCase):
+    """
+    Tests that a bulk load produces the same db (indexes included) as a regular load, reports its throughput, and that
+    its integrity check catches dangling relationships
+    """
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+
+    def tearDown(self):
+
+        self.tmp_dir.cleanup()
+
+
+    def _indexes(self, db_file):
+
+        with closing(sqlite3.connect(db_file)) as conn:
+            return conn.execute("select name, tbl_name, sql from sqlite_master where type = 'index' order by name").fetchall()
+
+
+    def test_bulk_matches_regular_load(self):
+
+        regular_db = os.path.join(self.tmp_dir.name, "regular.db")
+        bulk_db = os.path.join(self.tmp_dir.name, "bulk.db")
+
+        self.assertIsNone(etl.db_setup(regular_db))
+        stats = etl.db_setup(bulk_db, chunk_size=5, bulk=True)
+
+        self.assertEqual(dump_tables(bulk_db), dump_tables(regular_db))
+        self.assertEqual(self._indexes(bulk_db), self._indexes(regular_db))
+        self.assertEqual({table: table_stats["rows"] for table, table_stats in stats.items()},
+                         {"instruments": 19, "names": 25, "assignments_by_name": 19, "assignments": 19})
+
+
+    def test_integrity_check(self):
+
+        db_file = os.path.join(self.tmp_dir.name, "orchestra.db")
+        etl.db_setup(db_file, bulk=True)
+
+        with closing(sqlite3.connect(db_file)) as conn:
+
+            etl.check_integrity(conn.cursor())
+            conn.execute("insert into assignments (player_id, instrument_id) values (1000, 1)")
+
+            with self.assertRaises(sqlite3.IntegrityError):
+                etl.check_integrity(conn.cursor())
+
+
+class ParallelEtlTest(DataDirTestCase):
+    """
+    Tests that parsing the input files in parallel, in shards, produces exactly the same db as a serial run
+    """
+
+    def test_parallel_matches_serial(self):
+
+        # blank lines can leave a shard with nothing to parse
+        self._write_input("names.txt", self._read_input("names.txt") + "\n\n\n\n")
+
+        serial_db = os.path.join(self.tmp_dir.name, "serial.db")
+        etl.db_setup(serial_db, data_dir=self.data_dir)
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, chunk_size=4, workers=2)
+        self.assertEqual(dump_tables(self.db_file), dump_tables(serial_db))
+
+        changes = etl.db_setup(self.db_file, data_dir=self.data_dir, chunk_size=4, workers=2, incremental=True)
+        self.assertEqual(changes["names"], {"inserted": 0, "updated": 0, "deleted": 0})
+
+
+    def test_bounded_window(self):
+
+        # only `window` shards are in flight at once: one more is submitted each time a parsed shard is taken
+        submitted = []
+
+        class CountingExecutor(object):
+
+            def __init__(self, executor):
+                self.executor = executor
+
+            def submit(self, *args):
+                submitted.append(args)
+                return self.executor.submit(*args)
+
+        with ProcessPoolExecutor(1) as executor:
+
+            chunks = etl.read_input_parallel(CountingExecutor(executor), self.data_dir, "names", 2, 3)
+            self.assertEqual(len(submitted), 3)
+
+            next(chunks)
+            self.assertEqual(len(submitted), 4)
+
+            names = pd.concat([next(chunks)] + list(chunks))
+
+        self.assertEqual(len(names) + 2, len(self._read_input("names.txt").splitlines()))
+
+
+class SyntheticRosterTest(DataDirTestCase):
+    """
+    Tests that a synthetic roster uses every name style, and that every one of its assignments links up to a musician
+    """
+
+    def test_roster_loads(self):
+
+        synthetic.write_roster(self.data_dir, 140)
+        etl.db_setup(self.db_file, data_dir=self.data_dir)
+
+        # which of the combined name pattern's styles each name matched, eg "fl" for "first last"
+        names = self._read_input("names.txt").splitlines()
+        styles = {etl.NAME_PATTERN.match(name).lastgroup.split("_")[0] for name in names}
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+
+            self.assertEqual(etl.report_unmatched_assignments(conn.cursor()), [])
+            self.assertEqual(conn.execute("select count(*) from names").fetchone()[0], 140)
+            self.assertEqual(conn.execute("select count(*) from assignments").fetchone()[0], 140)
+
+        self.assertEqual(styles, {"fl", "fml", "f", "lf", "lfm"})
+
+
+class IncrementalEtlTest(DataDirTestCase):
+    """
+    Tests that an incremental load only touches the rows that changed in the input files, and that it ends up with the
+    same data as a full rebuild from those files
+    """
+
+    def setUp(self):
+
+        super().setUp()
+        etl.db_setup(self.db_file, data_dir=self.data_dir)
+
+
+    def _get_views(self, db_file):
+
+        with closing(sqlite3.connect(db_file)) as conn:
+            return {view: sorted(conn.execute("select * from {}".format(view)).fetchall(), key=repr) for view in reports.REPORT_VIEWS}
+
+
+    def test_no_changes(self):
+
+        before = dump_tables(self.db_file)
+        changes = etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True)
+
+        self.assertEqual(dump_tables(self.db_file), before)
+
+        for table_changes in changes.values():
+            self.assertEqual(table_changes, {"inserted": 0, "updated": 0, "deleted": 0})
+
+
+    def test_changes(self):
+
+        before = dump_tables(self.db_file)
+
+        # rename one musician, drop another, and add a new musician who plays the (previously unplayed) trumpet
+        names = self._read_input("names.txt").replace("Goofy\n", "Goofy Goof\n").replace("Felix Cat\n", "")
+        self._write_input("names.txt", names + "Nelson Muntz\n")
+        self._write_input("name_instrument.csv", self._read_input("name_instrument.csv") + "Trumpet,Nelson Muntz\n")
+
+        changes = etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True)
+        after = dump_tables(self.db_file)
+
+        # the renamed musician is a different row to the one they replace, and no musician takes over the dropped one's id
+        self.assertEqual(changes["names"], {"inserted": 2, "updated": 0, "deleted": 2})
+        self.assertEqual(changes["instruments"], {"inserted": 0, "updated": 0, "deleted": 0})
+        self.assertEqual(changes["assignments_by_name"], {"inserted": 1, "updated": 0, "deleted": 0})
+        self.assertEqual(changes["assignments"], {"inserted": 1, "updated": 0, "deleted": 0})
+
+        # all of the untouched rows keep their ids
+        changed_names = {("goofy", None, None), ("felix", None, "cat")}
+        self.assertEqual([row for row in after["names"] if row[1:] not in {("goofy", None, "goof"), ("nelson", None, "muntz")}],
+                         [row for row in before["names"] if row[1:] not in changed_names])
+        self.assertEqual([row[0] for row in after["names"][-2:]], [before["names"][-1][0] + 1, before["names"][-1][0] + 2])
+        self.assertEqual(after["instruments"], before["instruments"])
+        self.assertEqual(after["assignments"][:-1], before["assignments"])
+
+        # and the reports contain the same data as a from-scratch load
+        rebuilt_db = os.path.join(self.tmp_dir.name, "rebuilt.db")
+        etl.db_setup(rebuilt_db, data_dir=self.data_dir)
+
+        self.assertEqual(self._get_views(self.db_file), self._get_views(rebuilt_db))
+
+
+    def test_instrument_moved(self):
+
+        before = dump_tables(self.db_file)
+
+        # an instrument is identified by its name, so moving it to another section updates it in place
+        self._write_input("instruments.csv", self._read_input("instruments.csv").replace("Viola,Strings", "Viola,Violas"))
+
+        changes = etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True)
+        after = dump_tables(self.db_file)
+
+        self.assertEqual(changes["instruments"], {"inserted": 0, "updated": 1, "deleted": 0})
+        self.assertEqual(changes["assignments"], {"inserted": 0, "updated": 0, "deleted": 0})
+        self.assertEqual([row for row in after["instruments"] if row[1] == "viola"],
+                         [(row[0], "viola", "violas") for row in before["instruments"] if row[1] == "viola"])
+
+
+    def test_search_index(self):
+
+        # the rows that changed are changed in the search indexes, which then match the ones a from-scratch load builds
+        names = self._read_input("names.txt").replace("Goofy\n", "Goofy Goof\n").replace("Felix Cat\n", "")
+        self._write_input("names.txt", names + "Nelson Muntz\n")
+        self._write_input("instruments.csv", self._read_input("instruments.csv").replace("Viola,Strings", "Viola,Violas"))
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True)
+
+        rebuilt_db = os.path.join(self.tmp_dir.name, "rebuilt.db")
+        etl.db_setup(rebuilt_db, data_dir=self.data_dir)
+
+        def matches(db_file, text, kind):
+            with closing(sqlite3.connect(db_file)) as conn:
+                return sorted(tuple(row.values())[1:] for row in search.search(conn, text, kind, page_size=1000)[0])
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            for index in ["names_fts", "instruments_fts"]:
+                conn.execute("insert into {0}({0}, rank) values ('integrity-check', 1)".format(index))
+
+        for text, kind in [("goo", "musicians"), ("felix", "musicians"), ("mun", "musicians"), ("a", "musicians"),
+                           ("viola", "instruments"), ("strings", "instruments")]:
+            self.assertEqual(matches(self.db_file, text, kind), matches(rebuilt_db, text, kind))
+
+        self.assertEqual(matches(self.db_file, "felix", "musicians"), [])
+        self.assertEqual(matches(self.db_file, "viola", "instruments"), [("viola", "violas")])
+
+
+class MaterializedReportsTest(DataDirTestCase):
+    """
+    Tests that the materialized report tables hold the same rows as the report views, and are refreshed (or dropped)
+    whenever the etl runs
+    """
+
+    def _table_exists(self, table):
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            return conn.execute("select count(*) from sqlite_master where type = 'table' and name = ?", [table]).fetchone()[0] == 1
+
+
+    def test_tables_match_views(self):
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, materialize_reports=True)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            self.assertEqual(reports.verify_report_tables(conn), [])
+
+
+    def test_pages_seek_by_rowid(self):
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, materialize_reports=True)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            for view_name in reports.REPORT_VIEWS:
+
+                table = reports.materialized_table(view_name)
+                plan = plans.query_plan(conn, reports.MATERIALIZED_KEYSET_QUERY["sql"].format(table=table), {"k1": 0, "limit": 100})
+
+                self.assertEqual(plan, ["SEARCH {} USING INTEGER PRIMARY KEY (rowid>?)".format(table)])
+
+
+    def test_mismatch_detected(self):
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, materialize_reports=True)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            conn.execute("update multiple_players_materialized set first_name = 'nobody' where rowid = 1")
+            self.assertEqual(reports.verify_report_tables(conn), ["multiple_players"])
+
+
+    def test_not_rewritten_without_changes(self):
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, materialize_reports=True)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            conn.execute("update multiple_players_materialized set first_name = 'nobody' where rowid = 1")
+            conn.commit()
+
+        # an incremental load that changes nothing leaves the snapshots alone
+        etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True, materialize_reports=True)
+
+        self.assertNotIn("refresh_reports", etl.stage_timer.stages)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            self.assertEqual(reports.verify_report_tables(conn), ["multiple_players"])
+
+
+    def test_created_by_incremental_load(self):
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir)
+        etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True, materialize_reports=True)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            self.assertEqual(reports.verify_report_tables(conn), [])
+
+
+    def test_refreshed_by_incremental_load(self):
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, materialize_reports=True)
+
+        self._write_input("name_instrument.csv", self._read_input("name_instrument.csv") + "Trumpet,Bart Simpson\n")
+        etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True, materialize_reports=True)
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            self.assertEqual(reports.verify_report_tables(conn), [])
+            self.assertNotIn(("trumpet", "brass"), conn.execute("select * from instruments_without_musicians_materialized").fetchall())
+
+
+    def test_dropped_when_not_materializing(self):
+
+        etl.db_setup(self.db_file, data_dir=self.data_dir, materialize_reports=True)
+        etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True)
+
+        for view_name in reports.REPORT_VIEWS:
+            self.assertFalse(self._table_exists(reports.materialized_table(view_name)))
+
+
+class FastStartupTest(DataDirTestCase):
+    """
+    Tests that the etl is skipped when the db was already built from the same inputs, and that a rebuilt db is swapped
+    in for the current one, which is backed up, keeping only the most recent backups
+    """
+
+    def setUp(self):
+
+        super().setUp()
+        etl.db_setup(self.db_file, data_dir=self.data_dir)
+
+
+    def _version(self, db_file):
+
+        with closing(sqlite3.connect(db_file)) as conn:
+            return reports.get_db_version(conn)
+
+
+    def _db_files(self):
+
+        return sorted(f for f in os.listdir(self.tmp_dir.name) if f != "data")
+
+
+    def test_skip_unchanged(self):
+
+        version = self._version(self.db_file)
+        etl.db_setup(self.db_file, data_dir=self.data_dir, skip_unchanged=True)
+
+        self.assertEqual(self._version(self.db_file), version)
+        self.assertEqual(self._db_files(), ["orchestra.db"])
+
+
+    def test_rebuild_changed(self):
+
+        version = self._version(self.db_file)
+        before = dump_tables(self.db_file)
+
+        self._write_input("instruments.csv", self._read_input("instruments.csv") + "kazoo,woodwind\n")
+        etl.db_setup(self.db_file, data_dir=self.data_dir, skip_unchanged=True)
+
+        backups = [f for f in self._db_files() if f.endswith(".bak")]
+
+        self.assertNotEqual(self._version(self.db_file), version)
+        self.assertIn(("kazoo", "woodwind"), [row[1:] for row in dump_tables(self.db_file)["instruments"]])
+        self.assertEqual(len(backups), 1)
+        self.assertEqual(dump_tables(os.path.join(self.tmp_dir.name, backups[0])), before)
+
+        # no temporary or write-ahead log files are left behind
+        self.assertEqual(self._db_files(), ["orchestra.db"] + backups)
+
+
+    def test_rebuild_while_reading(self):
+
+        # a reader with the db open stays on the same file, and sees the rebuilt db from its next transaction on
+        inode = os.stat(self.db_file).st_ino
+
+        with closing(sqlite3.connect(self.db_file)) as reader:
+
+            version = reports.get_db_version(reader)
+
+            self._write_input("instruments.csv", self._read_input("instruments.csv") + "kazoo,woodwind\n")
+            etl.db_setup(self.db_file, data_dir=self.data_dir)
+
+            self.assertEqual(os.stat(self.db_file).st_ino, inode)
+            self.assertNotEqual(reports.get_db_version(reader), version)
+            self.assertIn(("kazoo", "woodwind"), reader.execute("select instrument, section from instruments").fetchall())
+            self.assertEqual(reader.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+            self.assertEqual(reader.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+
+    def test_fingerprint_path_escaped(self):
+
+        # characters that mean something in a uri are escaped when the db is opened to read its fingerprint
+        db_file = os.path.join(self.tmp_dir.name, "orchestra?#%.db")
+        etl.db_setup(db_file, data_dir=self.data_dir)
+
+        self.assertEqual(etl.get_input_fingerprint(db_file), etl.input_fingerprint(self.data_dir))
+        self.assertIsNone(etl.db_setup(db_file, data_dir=self.data_dir, skip_unchanged=True))
+
+
+    def test_fingerprint_file_boundaries(self):
+
+        # the same bytes, split differently between the input files, are different inputs
+        fingerprint = etl.input_fingerprint(self.data_dir)
+        instruments = self._read_input("instruments.csv")
+
+        self._write_input("instruments.csv", instruments[:-1])
+        self._write_input("names.txt", instruments[-1] + self._read_input("names.txt"))
+
+        self.assertNotEqual(etl.input_fingerprint(self.data_dir), fingerprint)
+
+
+    def test_incremental_schema_changed(self):
+
+        # a db built with another schema is rebuilt, rather than updated, by an incremental run
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            self.assertEqual(conn.execute("select value from etl_metadata where key = 'schema_fingerprint'").fetchone()[0],
+                             etl.schema_fingerprint())
+
+            conn.execute("update etl_metadata set value = 'old' where key = 'schema_fingerprint'")
+            conn.commit()
+
+        self._write_input("instruments.csv", self._read_input("instruments.csv") + "kazoo,woodwind\n")
+
+        self.assertIsNone(etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True))
+        self.assertEqual(etl.get_schema_fingerprint(self.db_file), etl.schema_fingerprint())
+        self.assertEqual(len([f for f in self._db_files() if f.endswith(".bak")]), 1)
+
+        # and once it's on the current schema, it's updated in place again
+        self._write_input("instruments.csv", self._read_input("instruments.csv") + "theremin,percussion\n")
+
+        self.assertEqual(etl.db_setup(self.db_file, data_dir=self.data_dir, incremental=True)["instruments"]["inserted"], 1)
+        self.assertEqual(len([f for f in self._db_files() if f.endswith(".bak")]), 1)
+
+
+    def test_rebuild_materialized(self):
+
+        version = self._version(self.db_file)
+        etl.db_setup(self.db_file, data_dir=self.data_dir, materialize_reports=True, skip_unchanged=True)
+
+        self.assertNotEqual(self._version(self.db_file), version)
+
+
+    def test_backup_rotation(self):
+
+        versions = []
+
+        for _ in range(4):
+            versions.append(self._version(self.db_file))
+            etl.db_setup(self.db_file, data_dir=self.data_dir, backups=2)
+
+        backups = [os.path.join(self.tmp_dir.name, f) for f in self._db_files() if f.endswith(".bak")]
+
+        self.assertEqual([self._version(backup) for backup in backups], versions[-2:])
+
+
+class QueryPlanTest(unittest.TestCase):
+    """
+    Tests that none of the report views, their paginated queries, the etl's link queries, or the search queries read a
+    whole table or sort without an index (other than where plans.ALLOWED_STEPS expects them to), against a synthetic
+    roster, both with and without table statistics for the query planner
+    """
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.db_file = os.path.join(cls.tmp_dir.name, "orchestra.db")
+
+        synthetic.write_roster(cls.tmp_dir.name, 20000)
+        etl.db_setup(cls.db_file, data_dir=cls.tmp_dir.name, bulk=True)
+
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.tmp_dir.cleanup()
+
+
+    def test_plans(self):
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            self.assertEqual(plans.check_plans(conn), {})
+
+
+    def test_plans_analyzed(self):
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            conn.execute("BEGIN")
+            conn.execute("ANALYZE")
+            self.assertEqual(plans.check_plans(conn), {})
+            conn.rollback()
+
+
+    def test_missing_index(self):
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+
+            conn.execute("BEGIN")
+            conn.execute("drop index assignments_instrument_id")
+            problems = plans.check_plans(conn)
+            conn.rollback()
+
+        self.assertIn("multiple_players", problems)
+        self.assertIn("instruments_without_musicians_page", problems)
+
+
 if __name__ == '__main__':
 
     unittest.main()
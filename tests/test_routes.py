@@ -0,0 +1,955 @@
+import unittest
+import msc_takehome.etl as etl
+import msc_takehome.export as export
+import msc_takehome.asgi as asgi
+import msc_takehome.roster as roster
+import msc_takehome.synthetic as synthetic
+import msc_takehome.shards as shards
+import msc_takehome.routes as routes
+from msc_takehome.reports import REPORT_VIEWS, set_db_version, get_db_version
+from msc_takehome.config import Config
+from msc_takehome.cache import ReportCache
+from msc_takehome.pool import ConnectionPool, PoolTimeout
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from importlib import resources
+from msc_takehome.render import render_table
+from msc_takehome.routes import app, report_cache, report_latency, encode_page_key
+import threading
+import tempfile
+import pandas as pd
+import subprocess
+import sqlite3
+import sys
+import html
+import csv
+import asyncio
+import gzip
+import io
+import json
+import os
+import re
+
+
+def table_rows(page):
+
+    return re.findall(r"<tr>\n(.*?)    </tr>", page, re.S)
+
+
+async def asgi_get(path, headers=(), method="GET"):
+
+    # a request to the asgi app, returning the status, headers, and body of its response
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": [(k.lower().encode(), v.encode()) for k, v in headers]}
+    await asgi.app(scope, receive, send)
+
+    return messages[0]["status"], dict(messages[0]["headers"]), messages[1]["body"]
+
+
+def reset_db_file(db_file):
+
+    # points the app back at its default db, and closes the connections it pooled to db_file
+    app.config.update(DB_FILE=Config.DB_FILE)
+    pool = routes.pools.pop(db_file, None)
+
+    if pool is not None:
+        pool.close_all()
+
+
+class AppDbTestCase(unittest.TestCase):
+    """
+    Base class for tests that share a db, built from the bundled input files, which the app is pointed at for the
+    duration of the class
+    """
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.db_file = os.path.join(cls.tmp_dir.name, "orchestra.db")
+        etl.db_setup(cls.db_file)
+
+        app.config.update(DB_FILE=cls.db_file)
+
+
+    @classmethod
+    def tearDownClass(cls):
+
+        reset_db_file(cls.db_file)
+        cls.tmp_dir.cleanup()
+
+
+class LruEvictionTest(unittest.TestCase):
+    """
+    Tests that ReportCache evicts its least recently used entry once it's full
+    """
+
+    def test_evicts_least_recently_used(self):
+
+        cache = ReportCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+
+    def test_disabled(self):
+
+        cache = ReportCache(0)
+        cache.put("a", 1)
+
+        self.assertIsNone(cache.get("a"))
+
+
+def process_report_df(df):
+
+    # NOTE: this is how routes.py used to prepare reports for df.to_html, before render.render_table took over. it's kept
+    # here as the reference for the html that render_table has to produce
+
+    # re-upper case strings
+    for column in df:
+
+        if df[column].dtype == "object":
+            df[column] = df[column].str.title()
+
+    # convert `None` to empty string
+    df = df.fillna(value="")
+
+    # convert database col names to human friendly
+    df = df.rename(
+        mapper=lambda col: col.replace("_", " ").title(),
+        axis="columns"
+    )
+
+    return df
+
+
+class RenderTableTest(unittest.TestCase):
+    """
+    Tests that render.render_table produces exactly the html that process_report_df + DataFrame.to_html did, and that
+    serving reports doesn't need pandas
+    """
+
+    def test_matches_to_html(self):
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+
+            db_file = os.path.join(tmp_dir, "orchestra.db")
+            etl.db_setup(db_file)
+
+            with closing(sqlite3.connect(db_file)) as conn:
+
+                # include a report with no rows, and values that need escaping
+                conn.execute("insert into names (first_name, last_name) values ('<b>', 'r&b')")
+                conn.execute("delete from assignments")
+
+                for view in REPORT_VIEWS:
+                    query = "select * from {}".format(view)
+                    expected = process_report_df(pd.read_sql(query, conn)).to_html(index=False)
+
+                    self.assertEqual(render_table(conn.execute(query)), expected)
+
+
+    def test_routes_without_pandas(self):
+
+        code = "import sys, msc_takehome.routes; sys.exit('pandas' in sys.modules)"
+        self.assertEqual(subprocess.run([sys.executable, "-c", code]).returncode, 0)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """
+    Tests that pooled connections are read-only, returned to the pool and reused across threads, limited in number, see
+    the db the etl rebuilt, and are reopened if the db file is replaced
+    """
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, "orchestra.db")
+        etl.db_setup(self.db_file)
+
+        self.pool = ConnectionPool(self.db_file, max_size=2, timeout=0.1)
+
+
+    def tearDown(self):
+
+        self.pool.close_all()
+        self.tmp_dir.cleanup()
+
+
+    def _open_db_files(self):
+
+        # the number of file descriptors this process has open on the db file
+        fds = "/proc/self/fd"
+
+        if not os.path.isdir(fds):
+            self.skipTest("needs /proc/self/fd")
+
+        db_file = os.path.realpath(self.db_file)
+
+        return sum(1 for fd in os.listdir(fds) if os.path.realpath(os.path.join(fds, fd)) == db_file)
+
+
+    def test_reused_across_threads(self):
+
+        with self.pool.connection() as conn:
+            pass
+
+        with ThreadPoolExecutor(1) as executor:
+            self.assertIs(executor.submit(self.pool.acquire).result(), conn)
+
+        self.assertEqual(len(self.pool), 1)
+
+
+    def test_bounded(self):
+
+        conns = [self.pool.acquire(), self.pool.acquire()]
+
+        self.assertIsNot(conns[0], conns[1])
+
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+
+        self.pool.release(conns[0])
+        self.assertIs(self.pool.acquire(), conns[0])
+
+
+    def test_requests_from_new_threads(self):
+
+        # a threaded server runs each request on a new thread, which mustn't leave a connection behind once it's gone
+        client = app.test_client()
+        app.config.update(DB_FILE=self.db_file)
+        report_cache.clear()
+
+        def get():
+            self.assertEqual(client.get("/report/all_musicians").status_code, 200)
+
+        try:
+            for _ in range(50):
+                thread = threading.Thread(target=get)
+                thread.start()
+                thread.join()
+
+            # every request borrowed (and gave back) the same connection
+            self.assertEqual(len(routes.pools[self.db_file]), 1)
+            self.assertLessEqual(self._open_db_files(), 2)
+
+        finally:
+            reset_db_file(self.db_file)
+
+
+    def test_read_only_wal(self):
+
+        with self.pool.connection() as conn:
+
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("delete from names")
+
+
+    def test_reads_while_etl_writes(self):
+
+        with self.pool.connection() as conn, closing(sqlite3.connect(self.db_file)) as writer:
+
+            writer.execute("begin immediate")
+            writer.execute("delete from assignments")
+
+            self.assertEqual(conn.execute("select count(*) from assignments").fetchone()[0], 19)
+
+
+    def test_sees_rebuild(self):
+
+        # the etl copies a rebuilt db into the current db file, so pooled connections carry on reading from the same file
+        with self.pool.connection() as conn:
+            version = get_db_version(conn)
+
+        etl.db_setup(self.db_file)
+
+        with self.pool.connection() as reused:
+            self.assertIs(reused, conn)
+            self.assertNotEqual(get_db_version(reused), version)
+
+
+    def test_reopened_when_replaced(self):
+
+        with self.pool.connection() as conn:
+            pass
+
+        replacement = os.path.join(self.tmp_dir.name, "replacement.db")
+        etl.db_setup(replacement)
+        os.replace(replacement, self.db_file)
+
+        with self.pool.connection() as reopened:
+            self.assertIsNot(reopened, conn)
+
+        self.assertEqual(len(self.pool), 1)
+
+
+class ReportCacheTest(AppDbTestCase):
+    """
+    Tests that rendered reports are cached against the db version, and that ETag / If-None-Match requests are answered
+    with 304 Not Modified
+    """
+
+    def setUp(self):
+
+        report_cache.clear()
+        self.client = app.test_client()
+
+
+    def test_repeat_requests_hit_cache(self):
+
+        first = self.client.get("/report/all_musicians")
+        hits = report_cache.hits
+        second = self.client.get("/report/all_musicians")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(report_cache.hits, hits + 1)
+        self.assertIn(b"Pepe", first.data)
+
+
+    def test_if_none_match(self):
+
+        etag = self.client.get("/report/multiple_players").headers["ETag"]
+        response = self.client.get("/report/multiple_players", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+
+    def test_etl_run_changes_etag(self):
+
+        etag = self.client.get("/report/multiple_players").headers["ETag"]
+        etl.db_setup(self.db_file)
+        response = self.client.get("/report/multiple_players", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+
+    def test_unknown_report(self):
+
+        self.assertEqual(self.client.get("/report/names").status_code, 404)
+
+
+class ReportPaginationTest(AppDbTestCase):
+    """
+    Tests that streamed reports render the same page as unstreamed ones, and that following the "next page" links of a
+    paginated report visits every row of the report exactly once, in order
+    """
+
+    def setUp(self):
+
+        self.client = app.test_client()
+
+
+    def test_streamed_matches_rendered(self):
+
+        for view in REPORT_VIEWS:
+
+            rendered = self.client.get("/report/{}?stream=0".format(view)).get_data(as_text=True)
+            streamed = self.client.get("/report/{}?stream=1".format(view)).get_data(as_text=True)
+
+            self.assertEqual(streamed, rendered)
+
+
+    def test_pages_cover_report(self):
+
+        for view in REPORT_VIEWS:
+
+            expected = table_rows(self.client.get("/report/{}".format(view)).get_data(as_text=True))
+            rows = []
+            url = "/report/{}?page_size=2".format(view)
+
+            while url:
+
+                page = self.client.get(url).get_data(as_text=True)
+                rows += table_rows(page)
+                next_link = re.search(r'<a href="(.*?)">Next page</a>', page)
+                url = html.unescape(next_link.group(1)) if next_link else None
+
+            self.assertEqual(rows, expected)
+
+
+    def test_bad_page_key(self):
+
+        self.assertEqual(self.client.get("/report/all_musicians?page_size=2&after=garbage").status_code, 400)
+        self.assertEqual(self.client.get("/report/all_musicians?page_size=0").status_code, 400)
+
+        # keys of the wrong length, or with values that can't be bound as query parameters
+        for key in [[1, 2], [1, 2, 3, 4], [[1], 2, 3], [{"a": 1}, 2, 3], {"a": 1}, [2 ** 70, 0, 0], [-2 ** 63 - 1, 0, 0],
+                    [True, 0, 0]]:
+            url = "/report/all_musicians?page_size=2&after={}".format(encode_page_key(key))
+            self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class MetricsTest(AppDbTestCase):
+    """
+    Tests that /metrics exposes the report latencies and the stage timings of the last etl run, and that slow report
+    queries are logged along with their query plan
+    """
+
+    def setUp(self):
+
+        self.client = app.test_client()
+        report_cache.clear()
+
+
+    def tearDown(self):
+
+        app.config.update(SLOW_QUERY_SECONDS=None)
+
+
+    def test_report_latency(self):
+
+        before = report_latency.count(view="all_musicians", phase="query")
+        self.client.get("/report/all_musicians")
+
+        self.assertEqual(report_latency.count(view="all_musicians", phase="query"), before + 1)
+
+        response = self.client.get("/metrics")
+        body = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+
+        for phase in ["query", "render", "total"]:
+            self.assertIn('orchestra_report_seconds_count{{view="all_musicians",phase="{}"}}'.format(phase), body)
+
+        self.assertIn('orchestra_report_seconds_bucket{view="all_musicians",phase="total",le="+Inf"}', body)
+
+
+    def test_etl_stages(self):
+
+        body = self.client.get("/metrics").get_data(as_text=True)
+
+        for stage in ["parse_names", "load_names", "link_assignments"]:
+            self.assertIn('orchestra_etl_stage_seconds{{stage="{}"}}'.format(stage), body)
+
+        self.assertIn('orchestra_etl_stage_rows{stage="load_names"} 25.0', body)
+
+
+    def test_slow_query_log(self):
+
+        app.config.update(SLOW_QUERY_SECONDS=0)
+
+        with self.assertLogs(app.logger, level="WARNING") as logs:
+            self.client.get("/report/multiple_players")
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("slow query", logs.output[0])
+        self.assertIn("SCAN", logs.output[0])
+
+
+class ExportTest(AppDbTestCase):
+    """
+    Tests that every report exports the same rows as its view, as csv and ndjson, with and without gzip, and that
+    exports can be narrowed down to a subset of columns
+    """
+
+    def setUp(self):
+
+        self.client = app.test_client()
+        app.config.update(EXPORT_BATCH_SIZE=7)
+
+
+    def tearDown(self):
+
+        app.config.update(EXPORT_BATCH_SIZE=1000)
+
+
+    def _view(self, view):
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            cursor = conn.execute("select * from {}".format(view))
+            return [col[0] for col in cursor.description], cursor.fetchall()
+
+
+    def test_csv(self):
+
+        for view in REPORT_VIEWS:
+
+            columns, rows = self._view(view)
+            response = self.client.get("/export/{}.csv".format(view))
+            lines = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+            self.assertEqual(response.mimetype, "text/csv")
+            self.assertEqual(lines[0], columns)
+            self.assertEqual(lines[1:], [["" if v is None else v for v in row] for row in rows])
+
+
+    def test_ndjson(self):
+
+        for view in REPORT_VIEWS:
+
+            columns, rows = self._view(view)
+            lines = self.client.get("/export/{}.ndjson".format(view)).get_data(as_text=True).splitlines()
+
+            self.assertEqual([json.loads(line) for line in lines], [dict(zip(columns, row)) for row in rows])
+
+
+    def test_gzip(self):
+
+        for export_format in ["csv", "ndjson"]:
+
+            url = "/export/all_musicians.{}".format(export_format)
+            plain = self.client.get(url)
+            gzipped = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+
+            self.assertIsNone(plain.content_encoding)
+            self.assertEqual(gzipped.content_encoding, "gzip")
+            self.assertEqual(gzip.decompress(gzipped.get_data()), plain.get_data())
+
+
+    def test_columns(self):
+
+        _, rows = self._view("all_musicians")
+
+        lines = self.client.get("/export/all_musicians.ndjson?columns=section,first_name").get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"section": row[4], "first_name": row[0]} for row in rows])
+
+        lines = list(csv.reader(io.StringIO(self.client.get("/export/all_musicians.csv?columns=last_name").get_data(as_text=True))))
+        self.assertEqual(lines, [["last_name"]] + [[row[2] or ""] for row in rows])
+
+        self.assertEqual(self.client.get("/export/all_musicians.csv?columns=first_name,nope").status_code, 400)
+
+
+    def test_not_found(self):
+
+        self.assertEqual(self.client.get("/export/names.csv").status_code, 404)
+        self.assertEqual(self.client.get("/export/all_musicians.xml").status_code, 404)
+
+
+    @unittest.skipUnless(export.pa, "pyarrow is not installed")
+    def test_arrow(self):
+
+        columns, rows = self._view("multiple_players")
+        data = self.client.get("/export/multiple_players.arrow").get_data()
+        table = export.pa.ipc.open_stream(data).read_all()
+
+        self.assertEqual(table.column_names, columns)
+        self.assertEqual(list(zip(*[table.column(col).to_pylist() for col in columns])), rows)
+
+
+    @unittest.skipIf(export.pa, "pyarrow is installed")
+    def test_arrow_unavailable(self):
+
+        self.assertEqual(self.client.get("/export/multiple_players.arrow").status_code, 501)
+
+
+class AsgiTest(AppDbTestCase):
+    """
+    Tests that the asgi app serves the same report pages as the flask app, and that concurrent requests for the same
+    report share a single query
+    """
+
+    def setUp(self):
+
+        report_cache.clear()
+
+
+    def test_matches_flask(self):
+
+        client = app.test_client()
+
+        for path in ["/"] + ["/report/{}".format(view) for view in REPORT_VIEWS]:
+
+            status, _, body = asyncio.run(asgi_get(path))
+
+            self.assertEqual(status, 200)
+            self.assertEqual(body, client.get(path).get_data())
+
+
+    def test_not_modified(self):
+
+        status, headers, _ = asyncio.run(asgi_get("/report/all_musicians"))
+        etag = headers[b"etag"].decode()
+
+        status, _, body = asyncio.run(asgi_get("/report/all_musicians", [("If-None-Match", etag)]))
+
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+
+
+    def test_not_found(self):
+
+        self.assertEqual(asyncio.run(asgi_get("/report/names"))[0], 404)
+        self.assertEqual(asyncio.run(asgi_get("/nope"))[0], 404)
+        self.assertEqual(asyncio.run(asgi_get("/", method="POST"))[0], 405)
+
+
+    def test_pool_timeout(self):
+
+        # with the pool's only connection taken, the report gets the same 503 that the flask app sends
+        routes.pools.pop(self.db_file).close_all()
+        app.config.update(DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.1)
+        pool = routes.get_pool(self.db_file)
+        conn = pool.acquire()
+        report_cache.clear()
+
+        try:
+            status, _, body = asyncio.run(asgi_get("/report/all_musicians"))
+
+            self.assertEqual(status, 503)
+            self.assertIn(b"Service Unavailable", body)
+
+        finally:
+            pool.release(conn)
+            routes.pools.pop(self.db_file).close_all()
+            app.config.update(DB_POOL_SIZE=Config.DB_POOL_SIZE, DB_POOL_TIMEOUT=Config.DB_POOL_TIMEOUT)
+
+        self.assertEqual(asyncio.run(asgi_get("/report/all_musicians"))[0], 200)
+
+
+    def test_head(self):
+
+        for path in ["/", "/report/all_musicians"]:
+
+            _, get_headers, body = asyncio.run(asgi_get(path))
+            status, headers, head_body = asyncio.run(asgi_get(path, method="HEAD"))
+
+            self.assertEqual(status, 200)
+            self.assertEqual(head_body, b"")
+            self.assertEqual(headers, get_headers)
+            self.assertEqual(int(headers[b"content-length"]), len(body))
+
+
+    def test_other_scopes(self):
+
+        messages = []
+
+        async def receive():
+            return {"type": "websocket.connect"}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi.app({"type": "websocket", "path": "/", "headers": []}, receive, send))
+        self.assertEqual(messages, [{"type": "websocket.close"}])
+
+        with self.assertRaises(ValueError):
+            asyncio.run(asgi.app({"type": "unknown"}, receive, send))
+
+
+    def test_single_flight(self):
+
+        async def get_many(n):
+            return await asyncio.gather(*[asgi_get("/report/multiple_players") for _ in range(n)])
+
+        queries = report_latency.count(view="multiple_players", phase="query")
+        shared = asgi.single_flight.shared
+
+        responses = asyncio.run(get_many(20))
+
+        self.assertEqual(report_latency.count(view="multiple_players", phase="query"), queries + 1)
+        self.assertEqual(asgi.single_flight.shared, shared + 19)
+        self.assertEqual(len({body for _, _, body in responses}), 1)
+
+
+class RosterIndexTest(unittest.TestCase):
+    """
+    Tests that the in-memory roster index builds every report exactly as its view does, and that it's reloaded when the
+    db version changes
+    """
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, "orchestra.db")
+        etl.db_setup(self.db_file)
+
+
+    def tearDown(self):
+
+        reset_db_file(self.db_file)
+        self.tmp_dir.cleanup()
+        app.config.update(ROSTER_INDEX=False)
+
+
+    def assertMatchesViews(self, db_file):
+
+        with closing(sqlite3.connect(db_file)) as conn:
+
+            index = roster.RosterIndex.load(conn)
+
+            for view in REPORT_VIEWS:
+                cursor = conn.execute("select * from {}".format(view))
+                self.assertEqual(index.report(view), ([col[0] for col in cursor.description], cursor.fetchall()))
+
+
+    def test_matches_views(self):
+
+        self.assertMatchesViews(self.db_file)
+
+
+    def test_matches_views_synthetic(self):
+
+        data_dir = os.path.join(self.tmp_dir.name, "data")
+        db_file = os.path.join(self.tmp_dir.name, "synthetic.db")
+
+        os.mkdir(data_dir)
+        synthetic.write_roster(data_dir, 2000, seed=3)
+        etl.db_setup(db_file, data_dir=data_dir)
+
+        self.assertMatchesViews(db_file)
+
+
+    def test_dangling_assignments(self):
+
+        # assignments to instruments / players that don't exist, and a duplicate assignment
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            conn.execute("insert into assignments (player_id, instrument_id) values (1, 999), (999, 1), (2, 1), (2, 1)")
+            conn.commit()
+
+        self.assertMatchesViews(self.db_file)
+
+
+    def test_reload(self):
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+
+            before = roster.get_roster(conn)
+            self.assertIs(roster.get_roster(conn), before)
+
+            conn.execute("insert into instruments (instrument, section) values ('kazoo', 'woodwind')")
+            set_db_version(conn)
+            conn.commit()
+
+            after = roster.get_roster(conn)
+
+        self.assertIsNot(after, before)
+        self.assertIn(("kazoo", "woodwind"), after.report("instruments_without_musicians")[1])
+
+
+    def test_route(self):
+
+        app.config.update(DB_FILE=self.db_file)
+        client = app.test_client()
+
+        for view in REPORT_VIEWS:
+
+            report_cache.clear()
+            app.config.update(ROSTER_INDEX=False)
+            expected = client.get("/report/{}".format(view)).get_data()
+
+            report_cache.clear()
+            app.config.update(ROSTER_INDEX=True)
+            self.assertEqual(client.get("/report/{}".format(view)).get_data(), expected)
+
+
+class SearchTest(unittest.TestCase):
+    """
+    Tests that /search finds musicians and instruments by the start of any of their words, pages through the matches,
+    and sees the changes made by an incremental etl run
+    """
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, "orchestra.db")
+        etl.db_setup(self.db_file)
+
+        app.config.update(DB_FILE=self.db_file)
+        self.client = app.test_client()
+
+
+    def tearDown(self):
+
+        reset_db_file(self.db_file)
+        self.tmp_dir.cleanup()
+
+
+    def _search(self, query):
+
+        response = self.client.get("/search?" + query)
+        self.assertEqual(response.status_code, 200)
+
+        return response.get_json()
+
+
+    def test_prefix(self):
+
+        results = self._search("q=ho+SIMP")
+
+        self.assertEqual([(m["first_name"], m["last_name"]) for m in results["musicians"]], [("homer", "simpson")])
+        self.assertEqual(results["instruments"], [])
+
+        results = self._search("q=bu")
+        self.assertEqual({m["last_name"] for m in results["musicians"]}, {"bunny", "burns"})
+
+
+    def test_pages(self):
+
+        with closing(sqlite3.connect(self.db_file)) as conn:
+            expected = [row[0] for row in conn.execute("select id from instruments where section = 'strings'")]
+
+        ids, page = [], 1
+
+        while page is not None:
+
+            results = self._search("q=strings&type=instruments&page_size=2&page={}".format(page))
+
+            self.assertNotIn("musicians", results)
+            ids += [i["id"] for i in results["instruments"]]
+            page = results["next_page"]
+
+        self.assertEqual(sorted(ids), sorted(expected))
+        self.assertEqual(len(ids), len(set(ids)))
+
+
+    def test_no_query(self):
+
+        self.assertEqual(self._search("q=%22*+()")["musicians"], [])
+        self.assertEqual(self.client.get("/search").status_code, 400)
+        self.assertEqual(self.client.get("/search?q=a&type=names").status_code, 400)
+        self.assertEqual(self.client.get("/search?q=a&page=0").status_code, 400)
+        self.assertEqual(self.client.get("/search?q=a&page=99999999999999999999").status_code, 400)
+
+
+    def test_incremental(self):
+
+        data_dir = os.path.join(self.tmp_dir.name, "data")
+        os.mkdir(data_dir)
+
+        for file_name in ["names.txt", "instruments.csv", "name_instrument.csv"]:
+            with open(os.path.join(data_dir, file_name), "w") as f:
+                f.write(resources.read_text("msc_takehome.data", file_name))
+
+        with open(os.path.join(data_dir, "names.txt"), "a") as f:
+            f.write("Zelda Zonk\n")
+
+        etl.db_setup(self.db_file, data_dir=data_dir, incremental=True)
+
+        self.assertEqual([m["last_name"] for m in self._search("q=zon")["musicians"]], ["zonk"])
+
+
+class ShardedReportTest(unittest.TestCase):
+    """
+    Tests that ensembles are loaded into their own shards, and that merged reports hold every ensemble's report, in the
+    view's order
+    """
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.ensembles = {}
+
+        for i, ensemble in enumerate(["brass band", "symphony"]):
+
+            data_dir = os.path.join(cls.tmp_dir.name, ensemble)
+            os.mkdir(data_dir)
+            synthetic.write_roster(data_dir, 300, num_instruments=30, seed=i)
+
+            cls.ensembles[ensemble] = {"db_file": os.path.join(cls.tmp_dir.name, ensemble + ".db"), "data_dir": data_dir}
+
+        etl.setup_ensembles(cls.ensembles, processes=2)
+
+
+    @classmethod
+    def tearDownClass(cls):
+
+        app.config.update(ENSEMBLES={})
+
+        for shard in cls.ensembles.values():
+            reset_db_file(shard["db_file"])
+
+        cls.tmp_dir.cleanup()
+
+
+    def _shard_reports(self, view):
+
+        shard_reports = {}
+
+        for ensemble, shard in self.ensembles.items():
+            with closing(sqlite3.connect(shard["db_file"])) as conn:
+                shard_reports[ensemble] = shards.shard_report(conn, view)
+
+        return shard_reports
+
+
+    def test_merge(self):
+
+        for view in REPORT_VIEWS:
+
+            columns, rows = shards.merge_reports(self._shard_reports(view))
+
+            for ensemble, shard in self.ensembles.items():
+                with closing(sqlite3.connect(shard["db_file"])) as conn:
+                    cursor = conn.execute("select * from {}".format(view))
+
+                    self.assertEqual(columns, ["ensemble"] + [col[0] for col in cursor.description])
+                    self.assertEqual([row[1:] for row in rows if row[0] == ensemble], cursor.fetchall())
+
+        _, rows = shards.merge_reports(self._shard_reports("instruments_without_musicians"))
+        self.assertEqual([row[2] for row in rows], sorted(row[2] for row in rows))
+
+
+    def test_route(self):
+
+        app.config.update(ENSEMBLES=self.ensembles)
+        client = app.test_client()
+
+        response = client.get("/report/multiple_players")
+        page = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("<th>Ensemble</th>", page)
+        self.assertIn("<td>Brass Band</td>", page)
+        self.assertIn("<td>Symphony</td>", page)
+        self.assertEqual(client.get("/report/multiple_players", headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
+        # reloading one ensemble changes the merged report's version
+        etl.db_setup(self.ensembles["symphony"]["db_file"], data_dir=self.ensembles["symphony"]["data_dir"])
+
+        self.assertEqual(client.get("/report/multiple_players", headers={"If-None-Match": response.headers["ETag"]}).status_code, 200)
+
+
+    def test_other_routes(self):
+
+        # none of the routes read from DB_FILE, which doesn't exist
+        app.config.update(ENSEMBLES=self.ensembles, DB_FILE=os.path.join(self.tmp_dir.name, "missing.db"))
+        client = app.test_client()
+
+        try:
+            _, rows = shards.merge_reports(self._shard_reports("all_musicians"))
+            export = list(csv.reader(io.StringIO(client.get("/export/all_musicians.csv").get_data(as_text=True))))
+
+            self.assertEqual(export[0], ["ensemble", "first_name", "middle_name", "last_name", "instrument", "section"])
+            self.assertEqual(export[1:], [[value or "" for value in row] for row in rows])
+
+            metrics = client.get("/metrics").get_data(as_text=True)
+
+            for ensemble in self.ensembles:
+                self.assertIn('orchestra_etl_stage_rows{{ensemble="{}",stage="load_names"}} 300'.format(ensemble), metrics)
+
+            status, _, body = asyncio.run(asgi_get("/report/multiple_players"))
+            self.assertEqual(status, 200)
+            self.assertEqual(body, client.get("/report/multiple_players").get_data())
+
+            # paging, streaming, and search aren't supported across ensembles, and say so
+            self.assertEqual(client.get("/report/all_musicians?page_size=10").status_code, 501)
+            self.assertEqual(client.get("/report/all_musicians?stream=1").status_code, 501)
+            self.assertEqual(client.get("/search?q=a").status_code, 501)
+
+        finally:
+            app.config.update(DB_FILE=Config.DB_FILE)
+
+
+if __name__ == '__main__':
+
+    unittest.main()